@@ -0,0 +1,182 @@
+"""Benchmarks for the model building, solve, extraction and rendering steps.
+
+Uses pytest-benchmark. Compare a run with the reference in ``baseline/``::
+
+    pytest benchmarks --benchmark-storage=benchmarks/baseline --benchmark-compare="*/0001_reference" --benchmark-compare-fail=mean:20%
+
+Timings depend on the machine, so to track changes on one machine save a
+baseline there first, then compare later runs against it::
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:20%
+
+Every benchmark runs on several mesh sizes and stores the peak memory
+traced during one call (in MiB) in its ``extra_info``.
+"""
+
+import tracemalloc
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import matplotlib.pyplot as plt  # noqa: E402
+
+import dc_app  # noqa: E402
+
+# numbers of core cells (ncx, ncz)
+MESH_SIZES = [(100, 50), (160, 80), (240, 120)]
+
+PLOT_ARGS = dict(
+    survey="Dipole-Dipole",
+    A=-30.5,
+    B=30.5,
+    M=-10.5,
+    N=10.5,
+    zcLayer=-10.0,
+    dzLayer=2.0,
+    xc=0.0,
+    zc=-25.0,
+    r=5.0,
+    rhohalf=500.0,
+    rholayer=5000.0,
+    rhoTarget=50.0,
+)
+
+# A, B, zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf
+FIELD_ARGS = (-30.5, 30.5, -10.0, 2.0, 0.0, -25.0, 5.0, 1 / 5000.0, 1 / 50.0, 1 / 500.0)
+
+
+@pytest.fixture(scope="module", params=MESH_SIZES, ids=lambda n: "%dx%d" % n)
+def mesh_size(request):
+    dc_app.setup_mesh(*request.param)
+    yield request.param
+    dc_app.setup_mesh()
+
+
+def run(benchmark, fun, *args, cold=False):
+    """Benchmark `fun(*args)` and record the peak memory of one call.
+
+    With `cold`, every round starts from empty caches.
+    """
+    if cold:
+        dc_app.clear_caches()
+    tracemalloc.start()
+    try:
+        fun(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        benchmark.extra_info["peak_memory_MiB"] = peak / 2**20
+    finally:
+        tracemalloc.stop()
+
+    if cold:
+        return benchmark.pedantic(fun, args, setup=dc_app.clear_caches, rounds=3)
+    return benchmark(fun, *args)
+
+
+def test_addcylinder2Mod(benchmark, mesh_size):
+    mod = np.ones(dc_app.mesh.nC)
+    run(benchmark, dc_app.addcylinder2Mod, 0.0, -25.0, 5.0, mod, 2.0)
+
+
+def test_addPlate2Mod(benchmark, mesh_size):
+    mod = np.ones(dc_app.mesh.nC)
+    run(benchmark, dc_app.addPlate2Mod, 0.0, -25.0, 10.0, 2.0, 30.0, mod, 2.0)
+
+
+# the two above only look up cached masks; these include the geometry test
+
+
+def test_addcylinder2Mod_cold(benchmark, mesh_size):
+    mod = np.ones(dc_app.mesh.nC)
+    run(benchmark, dc_app.addcylinder2Mod, 0.0, -25.0, 5.0, mod, 2.0, cold=True)
+
+
+def test_addPlate2Mod_cold(benchmark, mesh_size):
+    mod = np.ones(dc_app.mesh.nC)
+    args = (0.0, -25.0, 10.0, 2.0, 30.0, mod, 2.0)
+    run(benchmark, dc_app.addPlate2Mod, *args, cold=True)
+
+
+def test_rasterizeBodies(benchmark, mesh_size):
+    bodies = [
+        {"type": "layer", "zc": -10.0, "dz": 2.0},
+        {"type": "cylinder", "xc": -15.0, "zc": -8.0, "r": 3.0},
+        {"type": "plate", "xc": 10.0, "zc": -15.0, "dx": 20.0, "dz": 2.0, "rotAng": 30.0},
+        {"type": "cylinder", "xc": 0.0, "zc": -25.0, "r": 5.0},
+    ]
+    run(benchmark, dc_app.rasterizeBodies, bodies)
+
+
+def test_model_fields_cold(benchmark, mesh_size):
+    run(benchmark, dc_app.model_fields, *FIELD_ARGS, cold=True)
+
+
+def test_model_fields_cached(benchmark, mesh_size):
+    dc_app.model_fields(*FIELD_ARGS)
+    run(benchmark, dc_app.model_fields, *FIELD_ARGS)
+
+
+def test_get_Surface_Potentials(benchmark, mesh_size):
+    mtrue, mhalf, src, primary_field, total_field = dc_app.model_fields(*FIELD_ARGS)
+    run(benchmark, dc_app.get_Surface_Potentials, "Dipole-Dipole", src, total_field)
+
+
+@pytest.mark.parametrize("n", [1, 10000])
+def test_calculateRhoA(benchmark, n):
+    rng = np.random.default_rng(0)
+    survey = rng.choice(dc_app.SURVEY_TYPES, n)
+    A, B, M, N = (rng.uniform(-30, 30, n) for _ in range(4))
+    VM, VN = rng.standard_normal(n), rng.standard_normal(n)
+    run(benchmark, dc_app.calculateRhoA, survey, VM, VN, A, B, M, N)
+
+
+def test_sumCylinderCharges(benchmark, mesh_size):
+    mtrue, mhalf, src, primary_field, total_field = dc_app.model_fields(*FIELD_ARGS)
+    qSecondary = total_field[src, "charge"] - primary_field[src, "charge"]
+    run(benchmark, dc_app.sumCylinderCharges, 0.0, -25.0, 5.0, qSecondary)
+
+
+def render(Field, Type, Scale):
+    fig = dc_app.makePlot(Field=Field, Type=Type, Scale=Scale, **PLOT_ARGS)
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+@pytest.mark.parametrize("Scale", ["Linear", "Log"])
+@pytest.mark.parametrize("Type", ["Total", "Primary", "Secondary"])
+@pytest.mark.parametrize("Field", ["Model", "Potential", "E", "J", "Charge"])
+def test_PLOT(benchmark, mesh_size, Field, Type, Scale):
+    render(Field, Type, Scale)
+    run(benchmark, render, Field, Type, Scale)
+
+
+@pytest.fixture(params=[2, 3], ids=["2.5D", "3D"])
+def dim(request):
+    dc_app.setup_mesh(dim=request.param)
+    yield request.param
+    dc_app.setup_mesh()
+
+
+def test_model_fields_dim(benchmark, dim):
+    # the same model solved in 2.5D and 3D; rho_a shows the difference
+    benchmark.group = "model_fields 2.5D vs 3D"
+    rho_a = dc_app.simulateSurvey(**PLOT_ARGS)["rho_a"]
+    benchmark.extra_info["rho_a"] = float(np.squeeze(rho_a))
+    run(benchmark, dc_app.model_fields, *FIELD_ARGS, cold=True)
+
+
+@pytest.fixture
+def surrogate():
+    import dc_surrogate
+
+    dc_app.setup_mesh()
+    return dc_surrogate.train(16, workers=1, rank=40)
+
+
+def test_surrogate_preview(benchmark, surrogate):
+    # compare with test_model_fields_cold; any error estimate is accepted
+    args = FIELD_ARGS + (np.inf,)
+    benchmark.extra_info["estimated_error"] = float(surrogate.preview(*args)[-1])
+    run(benchmark, surrogate.preview, *args)
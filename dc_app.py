@@ -1,11 +1,19 @@
 import numpy as np
 
 from scipy.constants import epsilon_0
+import scipy.sparse as sp
+import collections
+import contextlib
 import copy
+import functools
+import inspect
+import json
+import sys
+import threading
+import time
 
 import matplotlib
 import matplotlib.pyplot as plt
-from matplotlib.path import Path
 
 from simpeg import maps, utils
 from simpeg.utils import extract_core_mesh
@@ -13,14 +21,117 @@ from simpeg.electromagnetics.static import resistivity as dc
 from simpeg.utils.solver_utils import get_default_solver
 
 from discretize import TensorMesh
+from discretize.utils import volume_average
+from pymatsolver import BiCGJacobi
 
 from ipywidgets import (
     interact_manual, interactive, widget, fixed,
-    Box, FloatSlider, FloatText, ToggleButtons
+    Box, FloatSlider, FloatText, HTML, ToggleButtons
 )
 
 Solver = get_default_solver()
 
+# Per-stage timings of the compute and render pipeline. A call to a function
+# wrapped with `timed` is one update; the stage times and counters recorded
+# while it runs are kept for the last few updates and optionally appended to
+# a JSON-lines log. Updates of a call with a `session` argument also go to
+# that AppSession's history and listeners (e.g. its ResLayerApp readout).
+_timings = {
+    "history": collections.deque(maxlen=20),
+    "counters": collections.Counter(),
+    "log": None,
+}
+_timing_state = threading.local()
+
+
+def record_stage(name, tic):
+    """Add the time since `tic` (from time.perf_counter) to stage `name`."""
+
+    update = getattr(_timing_state, "update", None)
+    if update is not None:
+        elapsed = time.perf_counter() - tic
+        update["stages"][name] = update["stages"].get(name, 0.0) + elapsed
+
+
+@contextlib.contextmanager
+def stage(name):
+    tic = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, tic)
+
+
+def count(name, n=1):
+    """Increment counter `name` (cache hits, solves, ...)."""
+
+    _timings["counters"][name] += n
+    update = getattr(_timing_state, "update", None)
+    if update is not None:
+        update["counters"][name] = update["counters"].get(name, 0) + n
+
+
+def timed(label):
+    """Record each call of the decorated function as one update.
+
+    Calls made while another update is running are folded into it.
+    """
+
+    def decorator(fun):
+        signature = inspect.signature(fun)
+
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            if getattr(_timing_state, "update", None) is not None:
+                return fun(*args, **kwargs)
+
+            try:
+                session = signature.bind(*args, **kwargs).arguments.get("session")
+            except TypeError:
+                session = None
+            update = {"label": label, "time": time.time(), "stages": {}, "counters": {}}
+            _timing_state.update = update
+            tic = time.perf_counter()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                update["total"] = time.perf_counter() - tic
+                _timing_state.update = None
+                _timings["history"].append(update)
+                if _timings["log"] is not None:
+                    with open(_timings["log"], "a") as f:
+                        f.write(json.dumps(update) + "\n")
+                if session is not None:
+                    session.timings.append(update)
+                    for listener in session.listeners:
+                        listener(update)
+
+        return wrapper
+
+    return decorator
+
+
+def get_timings(n=None):
+    """The last `n` (default all kept) updates, oldest first."""
+
+    history = list(_timings["history"])
+    return history if n is None else history[-n:]
+
+
+def get_counters():
+    return dict(_timings["counters"])
+
+
+def set_timing_log(path=None, history=None):
+    """Append every update to the JSON-lines file `path` (None to stop).
+
+    `history` changes how many updates `get_timings` keeps.
+    """
+
+    _timings["log"] = path
+    if history is not None:
+        _timings["history"] = collections.deque(_timings["history"], maxlen=history)
+
 class MyApp(Box):
     def __init__(self, widgets, kwargs):
         self._kwargs = kwargs
@@ -65,13 +176,6 @@ def widgetify(fun, layout=None, manual=False, **kwargs):
 npad = 8
 growrate = 2.0
 cs = 1.0
-hx = [(cs, npad, -growrate), (cs, 100), (cs, npad, growrate)]
-hy = [(cs, npad, -growrate), (cs, 50)]
-mesh = TensorMesh([hx, hy], "CN")
-expmap = maps.ExpMap(mesh)
-# actmap = maps.InjectActiveCells(mesh, ~airInd, np.log(1e-8))
-mapping = expmap
-# mapping = maps.IdentityMap(mesh)
 dx = 5
 xr = np.arange(-40, 41, dx)
 dxr = np.diff(xr)
@@ -80,20 +184,147 @@ xmax = 40.0
 ymin = -40.0
 ymax = 8.0
 xylim = np.c_[[xmin, ymin], [xmax, ymax]]
-indcC, meshcore = extract_core_mesh(xylim, mesh)
-indx = (
-    (mesh.gridFx[:, 0] >= xmin)
-    & (mesh.gridFx[:, 0] <= xmax)
-    & (mesh.gridFx[:, 1] >= ymin)
-    & (mesh.gridFx[:, 1] <= ymax)
-)
-indy = (
-    (mesh.gridFy[:, 0] >= xmin)
-    & (mesh.gridFy[:, 0] <= xmax)
-    & (mesh.gridFy[:, 1] >= ymin)
-    & (mesh.gridFy[:, 1] <= ymax)
-)
-indF = np.concatenate((indx, indy))
+
+
+def build_mesh(ncx=100, ncz=50):
+    """Set the global mesh, mapping and core-region indices.
+
+    `ncx` and `ncz` are the numbers of core cells; the core has to cover
+    the plotted region, so they should be at least the defaults.
+    """
+
+    global hx, hy, mesh, expmap, mapping, indcC, meshcore, indx, indy, indF
+
+    hx = [(cs, npad, -growrate), (cs, ncx), (cs, npad, growrate)]
+    hy = [(cs, npad, -growrate), (cs, ncz)]
+    mesh = TensorMesh([hx, hy], "CN")
+    expmap = maps.ExpMap(mesh)
+    # actmap = maps.InjectActiveCells(mesh, ~airInd, np.log(1e-8))
+    mapping = expmap
+    # mapping = maps.IdentityMap(mesh)
+    indcC, meshcore = extract_core_mesh(xylim, mesh)
+    indx = (
+        (mesh.gridFx[:, 0] >= xmin)
+        & (mesh.gridFx[:, 0] <= xmax)
+        & (mesh.gridFx[:, 1] >= ymin)
+        & (mesh.gridFx[:, 1] <= ymax)
+    )
+    indy = (
+        (mesh.gridFy[:, 0] >= xmin)
+        & (mesh.gridFy[:, 0] <= xmax)
+        & (mesh.gridFy[:, 1] >= ymin)
+        & (mesh.gridFy[:, 1] <= ymax)
+    )
+    indF = np.concatenate((indx, indy))
+
+
+build_mesh()
+
+# Optional 3D mode: the 2D model is extruded along y over the strike length
+# onto a 3D mesh sized to a memory budget, solved with an iterative solver,
+# and the fields are interpolated back onto the y = 0 section of the 2D mesh.
+dimension = 2
+strikeLength = 20.0
+# arguments of the last setup_mesh, to set up the same mesh in other processes
+meshSetup = {
+    "ncx": 100, "ncz": 50, "dim": 2, "ncy": 40, "strike": 20.0, "memory_budget": 256
+}
+Solver3D = BiCGJacobi
+solver_opts3D = {"rtol": 1e-6, "maxiter": 5000}
+# peak memory per cell (bytes) of the 3D solves of a `model_fields` update,
+# measured with tracemalloc
+bytes_per_cell3D = 1700
+
+
+def build_mesh3D(ncy=40, memory_budget=256):
+    """Set the global 3D mesh and its operators to and from the 2D mesh.
+
+    The 3D mesh covers the 2D core and `ncy` core cells along y, with cells
+    coarsened by the smallest integer factor whose estimated solve memory
+    fits within `memory_budget` (MiB).
+    """
+
+    global mesh3D, avg3D, sliceCC, sliceF
+
+    ncx = mesh.shape_cells[0] - 2 * npad
+    ncz = mesh.shape_cells[1] - npad
+    for factor in range(1, max(ncx, ncy, ncz) + 1):
+        ncx3, ncy3, ncz3 = (int(np.ceil(n / factor)) for n in (ncx, ncy, ncz))
+        # an odd number of cells puts a cell centre on y = 0
+        ncy3 += 1 - ncy3 % 2
+        nC = (ncx3 + 2 * npad) * (ncy3 + 2 * npad) * (ncz3 + npad)
+        if nC * bytes_per_cell3D <= memory_budget * 2**20:
+            break
+    else:
+        raise ValueError("no 3D mesh fits in %g MiB" % memory_budget)
+
+    h = factor * cs
+    hx3 = [(h, npad, -growrate), (h, ncx3), (h, npad, growrate)]
+    hy3 = [(h, npad, -growrate), (h, ncy3), (h, npad, growrate)]
+    hz3 = [(h, npad, -growrate), (h, ncz3)]
+    mesh3D = TensorMesh([hx3, hy3, hz3], "CCN")
+
+    # 2D models onto the x-z cells of the 3D mesh
+    avg3D = volume_average(
+        mesh,
+        TensorMesh([mesh3D.h[0], mesh3D.h[2]], mesh3D.origin[[0, 2]]),
+    )
+
+    # 3D fields onto the 2D cell centres and faces at y = 0
+    def onSection(locs):
+        return np.c_[locs[:, 0], np.zeros(len(locs)), locs[:, 1]]
+
+    sliceCC = mesh3D.get_interpolation_matrix(onSection(mesh.cell_centers), "CC")
+    sliceF = sp.vstack(
+        [
+            mesh3D.get_interpolation_matrix(onSection(mesh.faces_x), "faces_x"),
+            mesh3D.get_interpolation_matrix(onSection(mesh.faces_y), "faces_z"),
+        ]
+    ).tocsr()
+
+
+def extrudeModel(mIn, mOut):
+    """3D log-conductivity from the 2D model `mIn` within half the strike
+    length of y = 0 and `mOut` beyond it."""
+
+    nx, ny, nz = mesh3D.shape_cells
+    inStrike = np.abs(mesh3D.cell_centers_y) <= strikeLength / 2.0
+    mIn = (avg3D @ mIn).reshape(nz, 1, nx)
+    mOut = (avg3D @ mOut).reshape(nz, 1, nx)
+    return np.where(inStrike[:, None], mIn, mOut).ravel()
+
+
+class SliceFields(object):
+    """Fields of a 3D simulation on the y = 0 section of the 2D mesh.
+
+    Indexed like simpeg fields, `f[src, "phi"]`, with the 2D sources in
+    `sources`, a dict of the 3D source solved for each: "phi" and
+    "charge_density" are interpolated to the 2D cell centres and "e" and "j"
+    to the 2D faces. The 3D "charge" is per cell, so its density is
+    interpolated instead and multiplied by the 2D cell areas, giving the
+    charge per metre of strike like a 2.5D simulation.
+    """
+
+    def __init__(self, fields, sources):
+        self.fields = fields
+        self.sources = sources
+        self.sliceCC = sliceCC
+        self.sliceF = sliceF
+        self.sliceCharge = utils.sdiag(mesh.cell_volumes) @ sliceCC
+        self._sections = {}
+
+    def __getitem__(self, key):
+        src, name = key
+        if key not in self._sections:
+            src3D = self.sources[src]
+            if name == "charge":
+                section = self.sliceCharge @ self.fields[src3D, "charge_density"]
+            elif name in ("e", "j"):
+                section = self.sliceF @ self.fields[src3D, name]
+            else:
+                section = self.sliceCC @ self.fields[src3D, name]
+            self._sections[key] = section
+        return self._sections[key]
 
 _cache = {
     "A": None,
@@ -106,85 +337,437 @@ _cache = {
     "sigLayer": None,
     "sigTarget": None,
     "sigHalf": None,
+    "bodies": None,
+    "mesh": None,
 }
 
 
-def model_fields(A, B, zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf):
+def solve_fields(sim, m):
+    """Same as `sim.fields(m)`, timing factorizations and solves separately.
+
+    3D simulations are solved in one step, with their iterative solver. The
+    fields keep their simulation alive, so its solvers are freed once the
+    solutions are in.
+    """
+
+    sim.model = m
+    if isinstance(sim, dc.Simulation3DCellCentered):
+        with stage("solve"):
+            f = sim.fields(m)
+        count("solves", sim.survey.nSrc)
+        sim.Ainv.clean()
+        sim.Ainv = None
+        return f
+
+    if sim.Ainv[0] is not None:
+        for Ainv in sim.Ainv:
+            Ainv.clean()
+    f = sim.fieldsPair(sim)
+    f._quad_weights = sim._quad_weights
+    for iky, ky in enumerate(sim._quad_points):
+        with stage("factorization"):
+            sim.Ainv[iky] = sim.solver(sim.getA(ky), **sim.solver_opts)
+        with stage("solve"):
+            f[:, sim._solutionType, iky] = sim.Ainv[iky] * sim.getRHS(ky)
+        sim.Ainv[iky].clean()
+        sim.Ainv[iky] = None
+    count("factorizations", sim.nky)
+    count("solves", sim.nky * sim.survey.nSrc)
+    return f
+
+
+def _nbytes(value):
+    # approximate memory held by a stored value; fields shared by several
+    # pole sources are split between their entries
+    if isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    fields = getattr(value, "fields", value)
+    if hasattr(fields, "_fields"):
+        arrays = [v for v in fields._fields.values() if isinstance(v, np.ndarray)]
+        return sum(a.nbytes for a in arrays) // max(fields.simulation.survey.nSrc, 1)
+    return sys.getsizeof(value)
+
+
+class SolutionStore(object):
+    """Thread-safe store of immutable solve results shared by all sessions.
+
+    `get` returns the stored value for a key, or computes it once: a
+    request for a key that another thread is already computing waits for
+    that result instead of starting a second solve. The least recently
+    used values are dropped once the stored values take more than
+    `maxbytes`.
+    """
+
+    def __init__(self, maxbytes=256 * 2**20):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._values = collections.OrderedDict()
+        self._sizes = {}
+        self._pending = {}
+
+    def get(self, key, compute):
+        return self.get_many([key], lambda missing: [compute()])[0]
+
+    def get_many(self, keys, compute):
+        """Values for several keys, like `get`.
+
+        `compute(missing)` gets the keys that are neither stored nor being
+        computed by another thread, and returns their values together, so
+        that they can share one solve.
+        """
+
+        values, waits, missing = {}, {}, []
+        with self._lock:
+            for key in keys:
+                if key in self._values:
+                    self._values.move_to_end(key)
+                    count("store_hits")
+                    values[key] = self._values[key]
+                elif key in self._pending:
+                    waits[key] = self._pending[key]
+                elif key not in missing:
+                    missing.append(key)
+            pending = {"done": threading.Event()}
+            for key in missing:
+                self._pending[key] = pending
+
+        if missing:
+            count("store_misses", len(missing))
+            try:
+                computed = dict(zip(missing, compute(missing)))
+            except BaseException as err:
+                pending["error"] = err
+                raise
+            else:
+                pending["values"] = computed
+                values.update(computed)
+                sizes = {key: _nbytes(value) for key, value in computed.items()}
+                with self._lock:
+                    for key, value in computed.items():
+                        self._values[key] = value
+                        self.nbytes += sizes[key] - self._sizes.get(key, 0)
+                        self._sizes[key] = sizes[key]
+                    while self.nbytes > self.maxbytes and len(self._values) > 1:
+                        key, _ = self._values.popitem(last=False)
+                        self.nbytes -= self._sizes.pop(key)
+            finally:
+                with self._lock:
+                    for key in missing:
+                        del self._pending[key]
+                pending["done"].set()
+
+        # computing our own keys first means threads never wait on each other
+        for key, other in waits.items():
+            count("store_coalesced")
+            other["done"].wait()
+            if "error" in other:
+                raise other["error"]
+            values[key] = other["values"][key]
+
+        return [values[key] for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+
+_store = SolutionStore()
+
+
+class AppSession(object):
+    """State of one ResLayerApp: the fields behind its last update.
+
+    Sessions only hold references to results in the shared `_store`, so
+    apps in one kernel neither overwrite each other's state nor solve the
+    same model twice.
+    """
+
+    def __init__(self):
+        self.cache = dict.fromkeys(_cache)
+        # this app's updates, and callbacks run after each one
+        self.timings = collections.deque(maxlen=20)
+        self.listeners = []
+
+
+def _source(A, B):
+    # one source object per electrode pair, so that total and primary fields
+    # computed for different models can be indexed with the same source
+    def make_source():
+        if B == []:
+            return dc.sources.Pole([], np.r_[A, 0.0])
+        return dc.sources.Dipole([], np.r_[A, 0.0], np.r_[B, 0.0])
 
-    re_run = (
-        _cache["A"] != A
-        or _cache["B"] != B
-        or _cache["zcLayer"] != zcLayer
-        or _cache["dzLayer"] != dzLayer
-        or _cache["xc"] != xc
-        or _cache["zc"] != zc
-        or _cache["r"] != r
-        or _cache["sigLayer"] != sigLayer
-        or _cache["sigTarget"] != sigTarget
-        or _cache["sigHalf"] != sigHalf
+    return _store.get(("source", A, None if B == [] else B), make_source)
+
+
+def _source3D(src):
+    # the same electrodes on the y = 0 section of the 3D mesh
+    def onSection(loc):
+        x, z = np.ravel(loc)
+        return np.r_[x, 0.0, z]
+
+    if isinstance(src, dc.sources.Pole):
+        return dc.sources.Pole([], onSection(src.location))
+    return dc.sources.Dipole(
+        [], onSection(src.location_a), onSection(src.location_b)
     )
-    if re_run:
-        # Create halfspace model
-        halfspaceMod = sigHalf * np.ones([mesh.nC])
-        mhalf = np.log(halfspaceMod)
-        # Add layer to model
-        LayerMod = addLayer2Mod(zcLayer, dzLayer, halfspaceMod, sigLayer)
-
-        # Add plate or cylinder
-        fullMod = addcylinder2Mod(xc, zc, r, LayerMod, sigTarget)
-        mtrue = np.log(fullMod)
-        if B == []:
-            src = dc.sources.Pole([], np.r_[A, 0.0])
-        else:
-            src = dc.sources.Dipole([], np.r_[A, 0.0], np.r_[B, 0.0])
-        survey = dc.Survey([src])
+
+
+def solve_sources(srcs, m):
+    """Fields of the 2D sources `srcs` for the log-conductivity `m`.
+
+    `m` is on the 2D mesh, or on `mesh3D` in 3D mode; the fields are indexed
+    with `srcs` and are on the 2D mesh either way.
+    """
+
+    if dimension == 3:
+        srcs3D = [_source3D(src) for src in srcs]
+        with stage("setup"):
+            sim = dc.Simulation3DCellCentered(
+                mesh3D,
+                survey=dc.Survey(srcs3D),
+                sigmaMap=maps.ExpMap(mesh3D),
+                solver=Solver3D,
+                solver_opts=solver_opts3D,
+            )
+        return SliceFields(solve_fields(sim, m), dict(zip(srcs, srcs3D)))
+
+    with stage("setup"):
         sim = dc.Simulation2DCellCentered(
-            mesh, survey=survey, sigmaMap=mapping, solver=Solver
+            mesh, survey=dc.Survey(srcs), sigmaMap=mapping, solver=Solver
         )
-        total_field = sim.fields(mtrue)
-        sim_prim = dc.Simulation2DCellCentered(
-            mesh, survey=survey, sigmaMap=mapping, solver=Solver
+    return solve_fields(sim, m)
+
+
+def _solve(srcs, m, mOff=None):
+    """Fields of `srcs` for the 2D log-conductivity `m`.
+
+    In 3D mode, `m` is extruded over the strike length and `mOff` (default
+    `m`) beyond it.
+    """
+
+    if dimension == 3:
+        with stage("model"):
+            m = extrudeModel(m, m if mOff is None else mOff)
+    else:
+        # cached models are updated in place
+        m = m.copy()
+    return solve_sources(srcs, m)
+
+
+def _electrodes(src):
+    # x locations of the current electrodes of a pole or dipole source
+    if isinstance(src, dc.sources.Pole):
+        return (float(np.ravel(src.location)[0]),)
+    return (float(src.location_a[0]), float(src.location_b[0]))
+
+
+class SuperposedFields(object):
+    """Fields of pole and dipole sources, superposed from pole solutions.
+
+    `poles` maps electrode x locations to the fields and pole source solved
+    for each. Indexed like simpeg fields, `f[src, "phi"]`, with any source
+    whose electrodes are among them: a dipole is the difference of the
+    fields of its two poles.
+    """
+
+    def __init__(self, poles):
+        self.poles = poles
+        self._values = {}
+
+    def __getitem__(self, key):
+        src, name = key
+        xs = _electrodes(src)
+        if (xs, name) not in self._values:
+            fields, pole = self.poles[xs[0]]
+            value = fields[pole, name]
+            if len(xs) == 2:
+                fields, pole = self.poles[xs[1]]
+                value = value - fields[pole, name]
+            self._values[(xs, name)] = value
+        return self._values[(xs, name)]
+
+
+def _pole_fields(key, xs, m, mOff=None):
+    """`SuperposedFields` of pole sources at `xs` for the model `m`.
+
+    Poles are stored under `key + (x,)`; the ones not stored yet are solved
+    together, sharing a factorization.
+    """
+
+    def solve(missing):
+        srcs = [dc.sources.Pole([], np.r_[k[-1], 0.0]) for k in missing]
+        fields = _solve(srcs, m, mOff)
+        return [(fields, src) for src in srcs]
+
+    poles = _store.get_many([key + (x,) for x in xs], solve)
+    return SuperposedFields(dict(zip(xs, poles)))
+
+
+def model_fields(
+    A,
+    B,
+    zcLayer,
+    dzLayer,
+    xc,
+    zc,
+    r,
+    sigLayer,
+    sigTarget,
+    sigHalf,
+    session=None,
+    bodies=(),
+    survey=None,
+):
+    """Model, source and the primary and total fields of one app update.
+
+    Each electrode is solved as a pole source, so the fields do not depend
+    on the survey type: with a "Pole-" `survey` the source is a pole at A,
+    but the B position is solved along with A, so that switching survey at
+    fixed electrodes needs no new solve.
+    """
+
+    cache = _cache if session is None else session.cache
+    bodiesKey = tuple(_body_key(body) + (float(body["rho"]),) for body in bodies)
+    # sessions outlive setup_mesh, so their fields are only reused on the
+    # mesh they were solved on
+    meshKey = _mesh_key()
+
+    re_run = (
+        cache["A"] != A
+        or cache["B"] != B
+        or cache["zcLayer"] != zcLayer
+        or cache["dzLayer"] != dzLayer
+        or cache["xc"] != xc
+        or cache["zc"] != zc
+        or cache["r"] != r
+        or cache["sigLayer"] != sigLayer
+        or cache["sigTarget"] != sigTarget
+        or cache["sigHalf"] != sigHalf
+        or cache["bodies"] != bodiesKey
+        or cache["mesh"] != meshKey
+    )
+    if re_run:
+        count("field_cache_misses")
+        with stage("model"):
+            mtrue, mhalf = assembleModel(
+                zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf, cache, bodies
+            )
+            mOff = None
+            if dimension == 3:
+                mOff = assembleOffStrikeModel(
+                    zcLayer, dzLayer, sigLayer, sigHalf, bodies
+                )
+
+        electrodes = [A] if B == [] else [A, B]
+        modelKey = (zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf)
+        modelKey += bodiesKey
+        total_field = _pole_fields(
+            ("total", meshKey) + modelKey, electrodes, mtrue, mOff
         )
-        primary_field = sim_prim.fields(mhalf)
-
-        _cache["A"] = A
-        _cache["B"] = B
-        _cache["zcLayer"] = zcLayer
-        _cache["dzLayer"] = dzLayer
-        _cache["xc"] = xc
-        _cache["zc"] = zc
-        _cache["r"] = r
-        _cache["sigLayer"] = sigLayer
-        _cache["sigTarget"] = sigTarget
-        _cache["sigHalf"] = sigHalf
-
-        _cache["mtrue"] = mtrue
-        _cache["mhalf"] = mhalf
-        _cache["src"] = src
-        _cache["total_field"] = total_field
-        _cache["primary_field"] = primary_field
+        primary_field = _pole_fields(("primary", meshKey, sigHalf), electrodes, mhalf)
+        # so is the geometric factor of any survey on these electrodes
+        precompute_Halfspace_Poles(electrodes)
+
+        cache["A"] = A
+        cache["B"] = B
+        cache["zcLayer"] = zcLayer
+        cache["dzLayer"] = dzLayer
+        cache["xc"] = xc
+        cache["zc"] = zc
+        cache["r"] = r
+        cache["sigLayer"] = sigLayer
+        cache["sigTarget"] = sigTarget
+        cache["sigHalf"] = sigHalf
+        cache["bodies"] = bodiesKey
+        cache["mesh"] = meshKey
+
+        cache["charges"] = None
+        cache["mtrue"] = mtrue
+        cache["mhalf"] = mhalf
+        cache["total_field"] = total_field
+        cache["primary_field"] = primary_field
+    else:
+        count("field_cache_hits")
+        mtrue = cache["mtrue"]
+        mhalf = cache["mhalf"]
+        total_field = cache["total_field"]
+        primary_field = cache["primary_field"]
+
+    if B == [] or survey in ("Pole-Dipole", "Pole-Pole"):
+        src = _source(A, [])
     else:
-        mtrue = _cache["mtrue"]
-        mhalf = _cache["mhalf"]
-        src = _cache["src"]
-        total_field = _cache["total_field"]
-        primary_field = _cache["primary_field"]
+        src = _source(A, B)
 
     return mtrue, mhalf, src, primary_field, total_field
 
 
-def addLayer2Mod(zcLayer, dzLayer, mod, sigLayer):
+def clear_caches():
+    """Forget all cached fields, charge regions and geometric factors."""
 
-    CCLocs = mesh.cell_centers
+    for key in _cache:
+        _cache[key] = None
+    _store.clear()
+    with _tables_lock:
+        _charge_regions.clear()
+        _G2D_tables.clear()
+        _masks.clear()
+
+
+def setup_mesh(ncx=100, ncz=50, dim=2, ncy=40, strike=20.0, memory_budget=256):
+    """Switch to a mesh with `ncx` by `ncz` core cells and clear the caches.
+
+    With `dim=3`, fields are solved on a 3D mesh with `ncy` core cells along
+    y, fitted to `memory_budget` (MiB) by `build_mesh3D`. Cylinders and
+    plates then extend `strike` metres along y; layers extend throughout.
+    """
+
+    global dimension, strikeLength, meshSetup
+
+    if dim not in (2, 3):
+        raise ValueError("dim must be 2 or 3, not %r" % dim)
+
+    build_mesh(ncx, ncz)
+    if dim == 3:
+        build_mesh3D(ncy, memory_budget)
+    dimension = dim
+    strikeLength = float(strike)
+    meshSetup = {
+        "ncx": ncx,
+        "ncz": ncz,
+        "dim": dim,
+        "ncy": ncy,
+        "strike": strike,
+        "memory_budget": memory_budget,
+    }
+    clear_caches()
+
+
+def getLayerMask(zcLayer, dzLayer):
+    """Cells whose centres lie within the layer.
+
+    `zcLayer` and `dzLayer` may be arrays, giving one row of the mask per
+    layer.
+    """
+
+    z = mesh.cell_centers[:, 1]
+    zcLayer = np.asarray(zcLayer, dtype=float)[..., None]
+    dzLayer = np.asarray(dzLayer, dtype=float)[..., None]
 
     zmax = zcLayer + dzLayer / 2.0
     zmin = zcLayer - dzLayer / 2.0
 
-    belowInd = np.where(CCLocs[:, 1] <= zmax)[0]
-    aboveInd = np.where(CCLocs[:, 1] >= zmin)[0]
-    layerInds = list(set(belowInd).intersection(aboveInd))
+    return (z <= zmax) & (z >= zmin)
+
 
-    mod[layerInds] = sigLayer
+def addLayer2Mod(zcLayer, dzLayer, mod, sigLayer):
+
+    mod[cachedMask("layer", zcLayer, dzLayer)] = sigLayer
     return mod
 
 
@@ -195,41 +778,35 @@ def getCylinderPoints(xc, zc, r):
     return np.c_[xs, zs]
 
 
-def addcylinder2Mod(xc, zc, r, modd, sigCylinder):
+def getCylinderMask(xc, zc, r):
+    """Cells whose centres lie inside the outline from `getCylinderPoints`.
 
-    # Get points for cylinder outline
-    cylinderPoints = getCylinderPoints(xc, zc, r)
-    mod = copy.copy(modd)
+    The outline is a regular polygon, so instead of a point-in-path test we
+    find the edge facing each cell centre and compare the centre's distance
+    along that edge normal with the apothem. `xc`, `zc` and `r` may be
+    arrays, giving one row of the mask per cylinder.
+    """
 
-    verts = []
-    codes = []
-    for ii in range(0, cylinderPoints.shape[0]):
-        verts.append(cylinderPoints[ii, :])
+    nEdges = 249
+    dAngle = 2.0 * np.pi / nEdges
 
-        if ii == 0:
-            codes.append(Path.MOVETO)
-        elif ii == cylinderPoints.shape[0] - 1:
-            codes.append(Path.CLOSEPOLY)
-        else:
-            codes.append(Path.LINETO)
-
-    path = Path(verts, codes)
     CCLocs = mesh.cell_centers
-    insideInd = np.where(path.contains_points(CCLocs))
-
-    # #Check selected cell centers by plotting
-    # # print insideInd
-    # fig = plt.figure()
-    # ax = fig.add_subplot(111)
-    # patch = patches.PathPatch(path, facecolor='none', lw=2)
-    # ax.add_patch(patch)
-    # plt.scatter(CCLocs[insideInd,0],CCLocs[insideInd,1])
-    # ax.set_xlim(-40,40)
-    # ax.set_ylim(-35,0)
-    # plt.axes().set_aspect('equal')
-    # plt.show()
-
-    mod[insideInd] = sigCylinder
+    xc = np.asarray(xc, dtype=float)[..., None]
+    zc = np.asarray(zc, dtype=float)[..., None]
+    r = np.asarray(r, dtype=float)[..., None]
+
+    dx = CCLocs[:, 0] - xc
+    dz = CCLocs[:, 1] - zc
+    edge = np.clip(np.floor((np.arctan2(dz, dx) + np.pi) / dAngle), 0, nEdges - 1)
+    normal = -np.pi + (edge + 0.5) * dAngle
+
+    return dx * np.cos(normal) + dz * np.sin(normal) <= r * np.cos(dAngle / 2.0)
+
+
+def addcylinder2Mod(xc, zc, r, modd, sigCylinder):
+
+    mod = copy.copy(modd)
+    mod[cachedMask("cylinder", xc, zc, r)] = sigCylinder
     return mod
 
 
@@ -258,43 +835,328 @@ def getPlateCorners(xc, zc, dx, dz, rotAng):
     return plateCorners
 
 
+def getPlateMask(xc, zc, dx, dz, rotAng):
+    """Cells whose centres lie inside the plate from `getPlateCorners`."""
+
+    plate = {"type": "plate", "xc": xc, "zc": zc, "dx": dx, "dz": dz, "rotAng": rotAng}
+    return rasterizeBodies([plate]) == 0
+
+
 def addPlate2Mod(xc, zc, dx, dz, rotAng, modd, sigPlate):
-    # use matplotlib paths to find CC inside of polygon
-    plateCorners = getPlateCorners(xc, zc, dx, dz, rotAng)
+
     mod = copy.copy(modd)
+    mod[cachedMask("plate", xc, zc, dx, dz, rotAng)] = sigPlate
+    return mod
 
-    verts = [
-        (plateCorners[0, :]),  # left, top
-        (plateCorners[1, :]),  # right, top
-        (plateCorners[3, :]),  # right, bottom
-        (plateCorners[2, :]),  # left, bottom
-        (plateCorners[0, :]),  # left, top (closes polygon)
-    ]
 
-    codes = [Path.MOVETO, Path.LINETO, Path.LINETO, Path.LINETO, Path.CLOSEPOLY]
+# geometry parameters of each body type in a model description
+BODY_PARAMETERS = {
+    "layer": ("zc", "dz"),
+    "cylinder": ("xc", "zc", "r"),
+    "plate": ("xc", "zc", "dx", "dz", "rotAng"),
+}
 
-    path = Path(verts, codes)
-    CCLocs = mesh.cell_centers
-    insideInd = np.where(path.contains_points(CCLocs))
-
-    # Check selected cell centers by plotting
-    # print insideInd
-    # fig = plt.figure()
-    # ax = fig.add_subplot(111)
-    # patch = patches.PathPatch(path, facecolor='none', lw=2)
-    # ax.add_patch(patch)
-    # plt.scatter(CCLocs[insideInd,0],CCLocs[insideInd,1])
-    # ax.set_xlim(-10,10)
-    # ax.set_ylim(-20,0)
-    # plt.axes().set_aspect('equal')
-    # plt.show()
-
-    mod[insideInd] = sigPlate
-    return mod
+
+def _body_key(body):
+    # hashable geometry of a body description
+    if body["type"] not in BODY_PARAMETERS:
+        raise ValueError(
+            "body type must be one of %s, not %r"
+            % (", ".join(BODY_PARAMETERS), body["type"])
+        )
+    return (body["type"],) + tuple(
+        float(body[name]) for name in BODY_PARAMETERS[body["type"]]
+    )
+
+
+def getBodyHalfPlanes(body):
+    """Centre, bounding box and half-planes of a body description.
+
+    A body is a dict with a "type" of "layer", "cylinder" or "plate", the
+    geometry named in `BODY_PARAMETERS` and a resistivity "rho". All bodies
+    are convex, so a point `p` is inside when
+    `normals @ (p - centre) <= offsets` holds for every half-plane. The
+    bounding box is `[xmin, xmax, zmin, zmax]`.
+    """
+
+    key = _body_key(body)
+    kind, geometry = key[0], key[1:]
+
+    if kind == "layer":
+        zcLayer, dzLayer = geometry
+        centre = np.r_[0.0, zcLayer]
+        normals = np.array([[0.0, 1.0], [0.0, -1.0]])
+        offsets = np.r_[dzLayer, dzLayer] / 2.0
+        bbox = np.r_[-np.inf, np.inf, zcLayer - dzLayer / 2.0, zcLayer + dzLayer / 2.0]
+
+    elif kind == "cylinder":
+        # the edges of the outline from getCylinderPoints, as in getCylinderMask
+        xc, zc, r = geometry
+        nEdges = 249
+        dAngle = 2.0 * np.pi / nEdges
+        normal = -np.pi + (np.arange(nEdges) + 0.5) * dAngle
+        centre = np.r_[xc, zc]
+        normals = np.c_[np.cos(normal), np.sin(normal)]
+        offsets = np.full(nEdges, r * np.cos(dAngle / 2.0))
+        bbox = np.r_[xc - r, xc + r, zc - r, zc + r]
+
+    else:
+        xc, zc = geometry[:2]
+        centre = np.r_[xc, zc]
+        corners = getPlateCorners(*geometry)[[0, 1, 3, 2]] - centre
+        edges = np.roll(corners, -1, axis=0) - corners
+        # outward normals, whichever way round the corners go
+        area = np.sum(corners[:, 0] * edges[:, 1] - corners[:, 1] * edges[:, 0])
+        normals = np.c_[edges[:, 1], -edges[:, 0]] * (1.0 if area >= 0 else -1.0)
+        offsets = np.sum(normals * corners, axis=1)
+        bbox = np.r_[
+            corners[:, 0].min() + xc,
+            corners[:, 0].max() + xc,
+            corners[:, 1].min() + zc,
+            corners[:, 1].max() + zc,
+        ]
+
+    return centre, bbox, normals, offsets
+
+
+def rasterizeBodies(bodies):
+    """Index of the last body containing each cell centre, -1 if none does.
+
+    Each body only tests the cells in its bounding box, found by a search of
+    the sorted tensor mesh cell centres, so the cost grows with the size of
+    the bodies rather than of the mesh. The candidate cells of all bodies
+    are then tested against their half-planes together in one pass. Later
+    bodies take precedence where bodies overlap.
+    """
+
+    owner = np.full(mesh.nC, -1)
+    if len(bodies) == 0:
+        return owner
+
+    parts = [getBodyHalfPlanes(body) for body in bodies]
+    centres = np.array([centre for centre, _, _, _ in parts])
+    normals = np.vstack([n for _, _, n, _ in parts])
+    offsets = np.hstack([c for _, _, _, c in parts])
+    nPlanes = np.array([len(c) for _, _, _, c in parts])
+    firstPlane = np.cumsum(nPlanes) - nPlanes
+
+    xCC, zCC = mesh.cell_centers_x, mesh.cell_centers_y
+    cells, owners = [], []
+    for ii, (_, bbox, _, _) in enumerate(parts):
+        ix = np.arange(
+            np.searchsorted(xCC, bbox[0]), np.searchsorted(xCC, bbox[1], "right")
+        )
+        iz = np.arange(
+            np.searchsorted(zCC, bbox[2]), np.searchsorted(zCC, bbox[3], "right")
+        )
+        ind = (iz[:, None] * len(xCC) + ix).ravel()
+        cells.append(ind)
+        owners.append(np.full(ind.size, ii))
+
+    cells = np.concatenate(cells)
+    owners = np.concatenate(owners)
+    if cells.size == 0:
+        return owner
+
+    # one row per candidate cell and half-plane of its body
+    counts = nPlanes[owners]
+    first = np.cumsum(counts) - counts
+    pair = np.repeat(np.arange(cells.size), counts)
+    plane = np.repeat(firstPlane[owners] - first, counts) + np.arange(counts.sum())
+
+    p = mesh.cell_centers[cells] - centres[owners]
+    ok = (
+        normals[plane, 0] * p[pair, 0] + normals[plane, 1] * p[pair, 1]
+        <= offsets[plane]
+    )
+    inside = np.logical_and.reduceat(ok, first)
+    np.maximum.at(owner, cells[inside], owners[inside])
+    return owner
+
+
+def getBodyOutlines(body):
+    """Lines outlining a body description in the model section."""
+
+    key = _body_key(body)
+    kind, geometry = key[0], key[1:]
+    if kind == "layer":
+        zcLayer, dzLayer = geometry
+        return [
+            np.c_[[xmin, xmax], [zcLayer + dzLayer / 2.0] * 2],
+            np.c_[[xmin, xmax], [zcLayer - dzLayer / 2.0] * 2],
+        ]
+    if kind == "cylinder":
+        return [getCylinderPoints(*geometry)]
+    return [getPlateCorners(*geometry)[[0, 1, 3, 2, 0]]]
+
+
+# guards the geometry, charge region and G2D tables, which the request
+# threads of all sessions share
+_tables_lock = threading.Lock()
+
+# geometry masks keyed by (kind, *geometry), most recently used last
+_masks = collections.OrderedDict()
+_mask_functions = {
+    "layer": getLayerMask,
+    "cylinder": getCylinderMask,
+    "plate": getPlateMask,
+    "bodies": lambda *keys: rasterizeBodies(
+        [dict(zip(("type",) + BODY_PARAMETERS[key[0]], key)) for key in keys]
+    ),
+}
+
+
+def cachedMask(kind, *geometry):
+    """Boolean cell mask of a "layer", "cylinder" or "plate" body.
+
+    The "bodies" kind takes the `_body_key` of several bodies and gives the
+    `rasterizeBodies` index of the body containing each cell. Masks are
+    cached by geometry, so moving a slider back, or changing only a
+    conductivity, does not redo the geometry test.
+    """
+
+    key = (kind,) + geometry
+    with _tables_lock:
+        mask = _masks.get(key)
+        if mask is not None:
+            _masks.move_to_end(key)
+    if mask is None:
+        count("mask_cache_misses")
+        mask = _mask_functions[kind](*geometry)
+        mask.setflags(write=False)
+        with _tables_lock:
+            _masks[key] = mask
+            while len(_masks) > 128:
+                _masks.popitem(last=False)
+    else:
+        count("mask_cache_hits")
+    return mask
+
+
+def getModelRegions(zcLayer, dzLayer, xc, zc, r, bodies=()):
+    """Cell indices of the half-space, layer, cylinder and extra bodies.
+
+    Extra `bodies` are described as in `getBodyHalfPlanes` and are laid over
+    the cylinder in order.
+    """
+
+    keys = (("layer", zcLayer, dzLayer), ("cylinder", xc, zc, r))
+    keys += tuple(_body_key(body) for body in bodies)
+    owner = cachedMask("bodies", *keys)
+
+    order = np.argsort(owner, kind="stable")
+    return tuple(np.split(order, np.searchsorted(owner[order], np.arange(len(keys)))))
+
+
+def assembleModel(
+    zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf, cache, bodies=()
+):
+    """Log-conductivity of the layer + cylinder (+ `bodies`) model and of its
+    half-space.
+
+    The arrays are kept in `cache` and updated in place: a new geometry only
+    reassigns the regions from cached masks, and a new conductivity only
+    rewrites the cells of its region. Arrays returned by earlier calls with
+    the same cache therefore change too.
+    """
+
+    geometry = (zcLayer, dzLayer, xc, zc, r) + tuple(_body_key(b) for b in bodies)
+    sigmas = (sigHalf, sigLayer, sigTarget) + tuple(1.0 / b["rho"] for b in bodies)
+    model = cache.get("model")
+
+    if model is None or model["mesh"] is not mesh:
+        model = cache["model"] = {
+            "mesh": mesh,
+            "geometry": None,
+            "sigmas": (None, None, None),
+            "mtrue": np.empty(mesh.nC),
+            "mhalf": np.empty(mesh.nC),
+        }
+
+    if model["geometry"] != geometry:
+        model["geometry"] = geometry
+        model["regions"] = getModelRegions(zcLayer, dzLayer, xc, zc, r, bodies)
+        model["sigmas"] = (None,) * len(sigmas)
+
+    mtrue, mhalf = model["mtrue"], model["mhalf"]
+    for ind, old, new in zip(model["regions"], model["sigmas"], sigmas):
+        if old != new:
+            mtrue[ind] = np.log(new)
+    if model["sigmas"][0] != sigHalf:
+        mhalf.fill(np.log(sigHalf))
+    model["sigmas"] = sigmas
+
+    return mtrue, mhalf
+
+
+def assembleOffStrikeModel(zcLayer, dzLayer, sigLayer, sigHalf, bodies=()):
+    """2D log-conductivity beyond the strike length, where only layers go on."""
+
+    layers = [b for b in bodies if b["type"] == "layer"]
+    keys = [("layer", zcLayer, dzLayer)] + [_body_key(b) for b in layers]
+    sigmas = [sigHalf, sigLayer] + [1.0 / b["rho"] for b in layers]
+    return np.log(sigmas)[cachedMask("bodies", *keys) + 1]
+
+
+def buildModels(zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf):
+    """Log-conductivity models for many layer + cylinder parameter sets.
+
+    The parameters broadcast against each other; the result has one row per
+    parameter set, built with batched geometry masks rather than a model at
+    a time.
+    """
+
+    zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf = (
+        np.broadcast_arrays(
+            *(
+                np.atleast_1d(np.asarray(v, dtype=float))
+                for v in (zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf)
+            )
+        )
+    )
+
+    # masks are only built for distinct geometries, so an ensemble with
+    # fixed geometry costs one geometry test
+    layers, layerInd = np.unique(np.c_[zcLayer, dzLayer], axis=0, return_inverse=True)
+    cylinders, cylinderInd = np.unique(np.c_[xc, zc, r], axis=0, return_inverse=True)
+    layerMask = getLayerMask(layers[:, 0], layers[:, 1])[layerInd.ravel()]
+    cylinderMask = getCylinderMask(*cylinders.T)[cylinderInd.ravel()]
+
+    models = np.repeat(np.log(sigHalf)[:, None], mesh.nC, axis=1)
+    models = np.where(layerMask, np.log(sigLayer)[:, None], models)
+    models = np.where(cylinderMask, np.log(sigTarget)[:, None], models)
+    return models
+
+
+def solveSurfacePotentials(survey, A, B, models):
+    """Surface potentials of one source for each row of `models`.
+
+    A single simulation is set up and reused for all of the models.
+    Returns the surface cell locations and an array with one potential
+    profile per model.
+    """
+
+    if survey == "Pole-Dipole" or survey == "Pole-Pole":
+        src = dc.sources.Pole([], np.r_[A, 0.0])
+    else:
+        src = dc.sources.Dipole([], np.r_[A, 0.0], np.r_[B, 0.0])
+    sim = dc.Simulation2DCellCentered(
+        mesh, survey=dc.Survey([src]), sigmaMap=mapping, solver=Solver
+    )
+
+    phiSurface = []
+    for m in np.atleast_2d(models):
+        xSurface, phi, phiScale = get_Surface_Potentials(
+            survey, src, solve_fields(sim, m)
+        )
+        phiSurface.append(utils.mkvc(phi))
+
+    return utils.mkvc(xSurface), np.array(phiSurface)
 
 
 def get_Surface_Potentials(survey, src, field_obj):
 
+    tic = time.perf_counter()
     phi = field_obj[src, "phi"]
     CCLoc = mesh.cell_centers
     zsurfaceLoc = np.max(CCLoc[:, 1])
@@ -304,64 +1166,110 @@ def get_Surface_Potentials(survey, src, field_obj):
     phiScale = 0.0
 
     if survey == "Pole-Dipole" or survey == "Pole-Pole":
-        refInd = utils.closestPoints(mesh, [xmax + 60.0, 0.0], gridLoc="CC")
+        refInd = mesh.closest_points_index([xmax + 60.0, 0.0], grid_loc="CC")
         # refPoint =  CCLoc[refInd]
         # refSurfaceInd = np.where(xSurface == refPoint[0])
         # phiScale = np.median(phiSurface)
         phiScale = phi[refInd]
         phiSurface = phiSurface - phiScale
 
+    record_stage("extraction", tic)
     return xSurface, phiSurface, phiScale
 
-def sumCylinderCharges(xc, zc, r, qSecondary):
-    chargeRegionVerts = getCylinderPoints(xc, zc, r + 0.5)
+def checkReceivers(survey, M, N):
+    """Raise a ValueError unless the receivers `survey` uses are at surface
+    cell centres, where the potentials are read."""
+
+    receivers = [("M", M)]
+    if survey.endswith("-Dipole"):
+        receivers.append(("N", N))
+    xSurface = mesh.cell_centers_x
+    for name, x in receivers:
+        if not np.any(xSurface == x):
+            raise ValueError(
+                "%s = %g is not at a surface cell centre, the nearest is %g"
+                % (name, x, xSurface[np.argmin(np.abs(xSurface - x))])
+            )
 
-    codes = chargeRegionVerts.shape[0] * [Path.LINETO]
-    codes[0] = Path.MOVETO
-    codes[-1] = Path.CLOSEPOLY
 
-    chargeRegionPath = Path(chargeRegionVerts, codes)
-    CCLocs = mesh.cell_centers
-    chargeRegionInsideInd = np.where(chargeRegionPath.contains_points(CCLocs))
+def get_Electrode_Potentials(survey, xSurface, phiSurface, M, N):
+
+    MInd = np.where(xSurface == M)
+    VM = phiSurface[MInd[0]]
+
+    if survey == "Dipole-Pole" or survey == "Pole-Pole":
+        VN = 0.0
+    else:
+        NInd = np.where(xSurface == N)
+        VN = phiSurface[NInd[0]]
+
+    return VM, VN
+
+
+# cells of the charge region around each cylinder geometry, keyed by
+# (xc, zc, r); the region is the cylinder grown by half a cell
+_charge_regions = {}
+
+
+def getChargeRegion(xc, zc, r):
+
+    key = (xc, zc, r)
+    with _tables_lock:
+        region = _charge_regions.get(key)
+    if region is None:
+        inside = np.where(getCylinderMask(xc, zc, r + 0.5))[0]
+        region = (inside, mesh.cell_centers[inside])
+        with _tables_lock:
+            if len(_charge_regions) >= 256:
+                _charge_regions.clear()
+            _charge_regions[key] = region
+    return region
 
-    plateChargeLocs = CCLocs[chargeRegionInsideInd]
-    plateCharge = qSecondary[chargeRegionInsideInd]
-    posInd = np.where(plateCharge >= 0)
-    negInd = np.where(plateCharge < 0)
-    qPos = utils.mkvc(plateCharge[posInd])
-    qNeg = utils.mkvc(plateCharge[negInd])
 
-    qPosLoc = plateChargeLocs[posInd, :][0]
-    qNegLoc = plateChargeLocs[negInd, :][0]
+def sumCylinderCharges(xc, zc, r, qSecondary):
+    """Positive and negative charge accumulated on the cylinder.
+
+    Returns the positive and negative sums, their charge-weighted centroids
+    and the dipole moment of the charge about the cylinder centre.
+    """
+
+    chargeRegionInd, chargeRegionLocs = getChargeRegion(xc, zc, r)
+    q = utils.mkvc(qSecondary[chargeRegionInd])
 
-    # qPosData = np.vstack([qPosLoc[:, 0], qPosLoc[:, 1], qPos]).T
-    # qNegData = np.vstack([qNegLoc[:, 0], qNegLoc[:, 1], qNeg]).T
+    # one column of weights per sign, so both sums and both centroids
+    # come out of a single matrix product
+    isPos = q >= 0
+    qSplit = np.c_[np.where(isPos, q, 0.0), np.where(isPos, 0.0, q)]
+    qPosSum, qNegSum = qSplit.sum(axis=0)
 
-    if qNeg.shape == (0,) or qPos.shape == (0,):
+    if np.all(isPos) or not np.any(isPos):
         qNegAvgLoc = np.r_[-10, -10]
         qPosAvgLoc = np.r_[+10, -10]
     else:
-        qNegAvgLoc = np.average(qNegLoc, axis=0, weights=qNeg)
-        qPosAvgLoc = np.average(qPosLoc, axis=0, weights=qPos)
+        qPosAvgLoc, qNegAvgLoc = (
+            chargeRegionLocs.T.dot(qSplit) / np.r_[qPosSum, qNegSum]
+        ).T
 
-    qPosSum = np.sum(qPos)
-    qNegSum = np.sum(qNeg)
+    dipoleMoment = (chargeRegionLocs - np.r_[xc, zc]).T.dot(q)
 
-    # # Check things by plotting
-    # fig = plt.figure()
-    # ax = fig.add_subplot(111)
-    # platePatch = patches.PathPatch(platePath, facecolor='none', lw=2)
-    # ax.add_patch(platePatch)
-    # chargeRegionPatch = patches.PathPatch(chargeRegionPath, facecolor='none', lw=2)
-    # ax.add_patch(chargeRegionPatch)
-    # plt.scatter(qNegAvgLoc[0],qNegAvgLoc[1],color='b')
-    # plt.scatter(qPosAvgLoc[0],qPosAvgLoc[1],color='r')
-    # ax.set_xlim(-15,5)
-    # ax.set_ylim(-25,-5)
-    # plt.axes().set_aspect('equal')
-    # plt.show()
+    return qPosSum, qNegSum, qPosAvgLoc, qNegAvgLoc, dipoleMoment
 
-    return qPosSum, qNegSum, qPosAvgLoc, qNegAvgLoc
+
+def get_Cylinder_Charges(xc, zc, r, src, primary_field, total_field, session=None):
+    """`sumCylinderCharges` of the secondary charge, memoized with the fields."""
+
+    cache = _cache if session is None else session.cache
+    charges = cache.get("charges")
+    # surrogate previews bypass model_fields, so the fields are checked too
+    key = (xc, zc, r)
+    if charges is None or charges[0] != key or charges[1] is not total_field:
+        count("charge_cache_misses")
+        qSecondary = total_field[src, "charge"] - primary_field[src, "charge"]
+        charges = (key, total_field, sumCylinderCharges(xc, zc, r, qSecondary))
+        cache["charges"] = charges
+    else:
+        count("charge_cache_hits")
+    return charges[2]
 
 
 # The only thing we need to make it work is a 2.5D field object in simpeg
@@ -387,32 +1295,257 @@ def getSensitivity(survey, A, B, M, N, model):
     return J[0]
 
 
+SURVEY_TYPES = ["Dipole-Dipole", "Dipole-Pole", "Pole-Dipole", "Pole-Pole"]
+
+
+def _electrode_array(x):
+    # pole surveys pass [] for the unused B or N electrode
+    if isinstance(x, list) and len(x) == 0:
+        return np.nan
+    return np.asarray(x, dtype=float)
+
+
 def calculateRhoA(survey, VM, VN, A, B, M, N):
+    """Apparent resistivity for one or many electrode configurations.
+
+    `survey` may be a single survey type or an array of them; the potentials
+    and electrode locations broadcast against each other, so thousands of
+    configurations are handled in a single call. Unused electrodes (B for
+    pole sources, N for pole receivers) may be given as [] or NaN.
+    """
 
     eps = 1e-9  # to stabilize division
 
-    if survey == "Dipole-Dipole":
-        G = 1.0 / (
-            1.0 / (np.abs(A - M) + eps)
-            - 1.0 / (np.abs(M - B) + eps)
-            - 1.0 / (np.abs(N - A) + eps)
-            + 1.0 / (np.abs(N - B) + eps)
-        )
-        rho_a = (VM - VN) * 2.0 * np.pi * G
-    elif survey == "Pole-Dipole":
-        G = 1.0 / (1.0 / (np.abs(A - M) + eps) - 1.0 / (np.abs(N - A) + eps))
-        rho_a = (VM - VN) * 2.0 * np.pi * G
-    elif survey == "Dipole-Pole":
-        G = 1.0 / (1.0 / (np.abs(A - M) + eps) - 1.0 / (np.abs(M - B) + eps))
-        rho_a = (VM) * 2.0 * np.pi * G
-    elif survey == "Pole-Pole":
-        G = 1.0 / (1.0 / (np.abs(A - M) + eps))
-        rho_a = (VM) * 2.0 * np.pi * G
+    survey = np.asarray(survey)
+    if not np.all(np.isin(survey, SURVEY_TYPES)):
+        raise ValueError("survey must be one of {}".format(SURVEY_TYPES))
+    srcDipole = np.char.startswith(survey, "Dipole-")
+    rxDipole = np.char.endswith(survey, "-Dipole")
+
+    A, B, M, N = (_electrode_array(x) for x in (A, B, M, N))
+    VM, VN = _electrode_array(VM), _electrode_array(VN)
+
+    invG = 1.0 / (np.abs(A - M) + eps)
+    invG = invG - np.where(srcDipole, 1.0 / (np.abs(M - B) + eps), 0.0)
+    invG = invG - np.where(rxDipole, 1.0 / (np.abs(N - A) + eps), 0.0)
+    invG = invG + np.where(
+        srcDipole & rxDipole, 1.0 / (np.abs(N - B) + eps), 0.0
+    )
+    G = 1.0 / invG
+
+    rho_a = np.where(rxDipole, VM - VN, VM) * 2.0 * np.pi * G
 
     return rho_a
 
 
-def PLOT(
+# 2D geometric factors, keyed by mesh and then by electrode configuration
+# (survey, A, B, M, N). The unit half-space poles they are computed from are
+# kept in `_store`, under `_halfspace_pole_keys`.
+_G2D_tables = {}
+
+
+def _mesh_key():
+    key = (
+        tuple(mesh.shape_cells),
+        tuple(mesh.origin),
+        tuple(np.concatenate(mesh.h)),
+    )
+    if dimension == 3:
+        key += (
+            tuple(mesh3D.shape_cells),
+            tuple(mesh3D.origin),
+            tuple(np.concatenate(mesh3D.h)),
+            strikeLength,
+        )
+    return key
+
+
+def _G2D_table():
+    with _tables_lock:
+        return _G2D_tables.setdefault(_mesh_key(), {})
+
+
+def _halfspace_pole_keys(xs):
+    meshKey = _mesh_key()
+    return [("halfspace pole", meshKey, float(x)) for x in xs]
+
+
+def precompute_Halfspace_Poles(xs):
+    """Unit half-space pole sources at the electrode locations `xs`.
+
+    Returns a dict of the surface and reference potentials of each pole.
+    Poles are kept in `_store` like the model fields: all new locations are
+    solved together as one multi-source simulation, sharing a single
+    factorization, and a location another session is solving is waited for.
+    """
+
+    xs = [float(x) for x in np.unique(np.asarray(xs, dtype=float))]
+
+    def solve(missing):
+        srcs = [dc.sources.Pole([], np.r_[key[-1], 0.0]) for key in missing]
+        # unit conductivity, log(1) = 0
+        nC = mesh3D.nC if dimension == 3 else mesh.nC
+        field_obj = solve_sources(srcs, np.zeros(nC))
+
+        CCLoc = mesh.cell_centers
+        surfaceInd = np.where(CCLoc[:, 1] == np.max(CCLoc[:, 1]))[0]
+        refInd = mesh.closest_points_index([xmax + 60.0, 0.0], grid_loc="CC")
+        poles = []
+        for src in srcs:
+            phi = utils.mkvc(field_obj[src, "phi"])
+            poles.append((phi[surfaceInd], np.squeeze(phi[refInd])))
+        return poles
+
+    return dict(zip(xs, _store.get_many(_halfspace_pole_keys(xs), solve)))
+
+
+def get_G2D(survey, A, B, M, N):
+    """Ratio of the analytic (3D) to the 2.5D half-space geometric factor.
+
+    Multiplying `calculateRhoA` by this factor gives the half-space
+    resistivity back for a homogeneous model. Accepts arrays of electrode
+    locations like `calculateRhoA`; factors are cached per mesh and
+    configuration, and the only solves are one pole source per new
+    electrode location. In 3D mode the factor is that of the 3D mesh, and
+    corrects its discretization instead.
+    """
+
+    survey, A, B, M, N = np.broadcast_arrays(
+        np.asarray(survey),
+        *(_electrode_array(x) for x in (A, B, M, N))
+    )
+    table = _G2D_table()
+    keys = [
+        (
+            str(s),
+            float(a),
+            float(b) if s.startswith("Dipole-") else None,
+            float(m),
+            float(n) if s.endswith("-Dipole") else None,
+        )
+        for s, a, b, m, n in zip(
+            survey.ravel(), A.ravel(), B.ravel(), M.ravel(), N.ravel()
+        )
+    ]
+    with _tables_lock:
+        missing = [key for key in set(keys) if key not in table]
+    count("G2D_cache_hits", len(keys) - len(missing))
+    if missing:
+        count("G2D_cache_misses", len(missing))
+        poles = precompute_Halfspace_Poles(
+            [key[1] for key in missing]
+            + [key[2] for key in missing if key[0].startswith("Dipole-")]
+        )
+        xSurface = utils.mkvc(mesh.cell_centers[:, 0][
+            mesh.cell_centers[:, 1] == np.max(mesh.cell_centers[:, 1])
+        ])
+
+        def surface_value(phi, x):
+            ind = np.where(xSurface == x)[0]
+            return phi[ind[0]] if len(ind) else np.nan
+
+        s = np.array([key[0] for key in missing])
+        a, b, m, n = (
+            np.array([key[ii] for key in missing], dtype=float) for ii in range(1, 5)
+        )
+        VM = np.empty(len(missing))
+        VN = np.zeros(len(missing))
+        for ii, key in enumerate(missing):
+            phi, phiRef = poles[key[1]]
+            if key[0].startswith("Dipole-"):
+                phi = phi - poles[key[2]][0]
+            else:
+                phi = phi - phiRef
+            VM[ii] = surface_value(phi, key[3])
+            if key[0].endswith("-Dipole"):
+                VN[ii] = surface_value(phi, key[4])
+
+        # the apparent resistivity of a unit half-space is 1 / G2D
+        G2D = 1.0 / calculateRhoA(s, VM, VN, a, b, m, n)
+        with _tables_lock:
+            table.update(zip(missing, G2D))
+
+    with _tables_lock:
+        G2D = [table[key] for key in keys]
+    return np.reshape(G2D, survey.shape)
+
+
+@timed("simulateSurvey")
+def simulateSurvey(
+    survey,
+    A,
+    B,
+    M,
+    N,
+    zcLayer,
+    dzLayer,
+    xc,
+    zc,
+    r,
+    rhohalf,
+    rholayer,
+    rhoTarget,
+    session=None,
+    bodies=(),
+):
+    """Headless equivalent of the numbers shown by `PLOT`.
+
+    Returns a dict with the 2D-corrected apparent resistivity, the electrode
+    potentials and the total and primary surface potential profiles.
+    """
+
+    checkReceivers(survey, M, N)
+
+    sigTarget = 1.0 / rhoTarget
+    sigLayer = 1.0 / rholayer
+    sigHalf = 1.0 / rhohalf
+
+    mtrue, mhalf, src, primary_field, total_field = model_fields(
+        A,
+        B,
+        zcLayer,
+        dzLayer,
+        xc,
+        zc,
+        r,
+        sigLayer,
+        sigTarget,
+        sigHalf,
+        session,
+        bodies,
+        survey,
+    )
+
+    if survey == "Pole-Dipole" or survey == "Pole-Pole":
+        B = []
+    if survey == "Dipole-Pole" or survey == "Pole-Pole":
+        N = []
+
+    xSurface, phiTotalSurface, phiScaleTotal = get_Surface_Potentials(
+        survey, src, total_field
+    )
+    xSurface, phiPrimSurface, phiScalePrim = get_Surface_Potentials(
+        survey, src, primary_field
+    )
+
+    VM, VN = get_Electrode_Potentials(survey, xSurface, phiTotalSurface, M, N)
+
+    # 2D geometric factor
+    G2D = get_G2D(survey, A, B, M, N)
+    rho_a = G2D * calculateRhoA(survey, VM, VN, A, B, M, N)
+
+    return {
+        "rho_a": float(np.squeeze(rho_a)),
+        "VM": float(np.squeeze(VM)),
+        "VN": float(np.squeeze(VN)),
+        "xSurface": utils.mkvc(xSurface),
+        "phiTotalSurface": utils.mkvc(phiTotalSurface),
+        "phiPrimSurface": utils.mkvc(phiPrimSurface),
+    }
+
+
+@timed("PLOT")
+def makePlot(
     survey,
     A,
     B,
@@ -429,21 +1562,64 @@ def PLOT(
     Field,
     Type,
     Scale,
+    session=None,
+    bodies=(),
+    surrogate=None,
+    tolerance=0.02,
 ):
+    """Draw the app figure for one set of widget values and return it.
+
+    `bodies` adds layers, cylinders and plates described as in
+    `getBodyHalfPlanes` on top of the layer and cylinder of the widgets.
+    With a `surrogate` (see `dc_surrogate`), the fields are predicted by it
+    whenever its error estimate is within `tolerance`.
+    """
 
     labelsize = 12.0
     ticksize = 12.0
 
-    if survey == "Pole-Dipole" or survey == "Pole-Pole":
-        B = []
-
     sigTarget = 1.0 / rhoTarget
     sigLayer = 1.0 / rholayer
     sigHalf = 1.0 / rhohalf
 
-    mtrue, mhalf, src, primary_field, total_field = model_fields(
-        A, B, zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf
-    )
+    preview = None
+    if surrogate is not None:
+        with stage("surrogate"):
+            preview = surrogate.preview(
+                A,
+                [] if survey == "Pole-Dipole" or survey == "Pole-Pole" else B,
+                zcLayer,
+                dzLayer,
+                xc,
+                zc,
+                r,
+                sigLayer,
+                sigTarget,
+                sigHalf,
+                tolerance,
+                bodies,
+            )
+    if preview is None:
+        mtrue, mhalf, src, primary_field, total_field = model_fields(
+            A,
+            B,
+            zcLayer,
+            dzLayer,
+            xc,
+            zc,
+            r,
+            sigLayer,
+            sigTarget,
+            sigHalf,
+            session,
+            bodies,
+            survey,
+        )
+    else:
+        mtrue, mhalf, src, primary_field, total_field, previewError = preview
+
+    if survey == "Pole-Dipole" or survey == "Pole-Pole":
+        B = []
 
     fig, ax = plt.subplots(2, 1, figsize=(6,  9), sharex=True, height_ratios=[0.6, 1.5])
     fig.subplots_adjust(wspace=0.05, hspace=0.05)
@@ -458,27 +1634,12 @@ def PLOT(
     xlim = np.array([-40, 40])
 
     if survey == "Dipole-Pole" or survey == "Pole-Pole":
-        MInd = np.where(xSurface == M)
         N = []
 
-        VM = phiTotalSurface[MInd[0]]
-        VN = 0.0
-
-        VMprim = phiPrimSurface[MInd[0]]
-        VNprim = 0.0
-
-    else:
-        MInd = np.where(xSurface == M)
-        NInd = np.where(xSurface == N)
-
-        VM = phiTotalSurface[MInd[0]]
-        VN = phiTotalSurface[NInd[0]]
-
-        VMprim = phiPrimSurface[MInd[0]]
-        VNprim = phiPrimSurface[NInd[0]]
+    VM, VN = get_Electrode_Potentials(survey, xSurface, phiTotalSurface, M, N)
 
     # 2D geometric factor
-    G2D = rhohalf / (calculateRhoA(survey, VMprim, VNprim, A, B, M, N))
+    G2D = get_G2D(survey, A, B, M, N)
 
     # Subplot 1: Full set of surface potentials
     ax[0].plot(xSurface, phiTotalSurface, color=[0.1, 0.5, 0.1], linewidth=2)
@@ -496,6 +1657,11 @@ def PLOT(
     ax[0].set_xlabel("x (m)", fontsize=labelsize)
     ax[0].set_xlim(xlim)
     ax[0].set_ylim(ylim)
+    if preview is not None:
+        ax[0].set_title(
+            "Surrogate preview (estimated error %.1e)" % previewError,
+            fontsize=labelsize,
+        )
 
     if survey == "Dipole-Pole" or survey == "Pole-Pole":
         ax[0].plot(M, VM, "o", color="k")
@@ -526,6 +1692,7 @@ def PLOT(
 
     ax[0].legend(["Model Potential", "Half-Space Potential"], loc=3, fontsize=labelsize)
 
+    tic = time.perf_counter()
     if Field == "Model":
 
         label = "Resisitivity (ohm-m)"
@@ -687,19 +1854,22 @@ def PLOT(
     #         u = uTotal - uPrim
     #     # u = np.log10(abs(u))
 
+    record_stage("extraction", tic)
+
     if Scale == "Log":
         eps = 1e-16
     else:
         eps = 0.0
-    dat = meshcore.plot_image(
-        u[ind] + eps,
-        v_type=xtype,
-        ax=ax[1],
-        grid=False,
-        view=view,
-        stream_opts=streamOpts,
-        pcolor_opts=pcolorOpts,
-    )  # gridOpts={'color':'k', 'alpha':0.5}
+    with stage("plot_image"):
+        dat = meshcore.plot_image(
+            u[ind] + eps,
+            v_type=xtype,
+            ax=ax[1],
+            grid=False,
+            view=view,
+            stream_opts=streamOpts,
+            pcolor_opts=pcolorOpts,
+        )  # gridOpts={'color':'k', 'alpha':0.5}
 
     # Get cylinder outline
     cylinderPoints = getCylinderPoints(xc, zc, r)
@@ -716,12 +1886,16 @@ def PLOT(
         ax[1].plot(layerX, layerTopY, linestyle="dashed", color="k")
         ax[1].plot(layerX, layerBottomY, linestyle="dashed", color="k")
 
+    for body in bodies:
+        if body["rho"] != rhohalf:
+            for outline in getBodyOutlines(body):
+                ax[1].plot(outline[:, 0], outline[:, 1], linestyle="dashed", color="k")
+
     if (Field == "Charge") and (Type != "Primary") and (Type != "Total"):
-        qTotal = total_field[src, "charge"]
-        qPrim = primary_field[src, "charge"]
-        qSecondary = qTotal - qPrim
-        qPosSum, qNegSum, qPosAvgLoc, qNegAvgLoc = sumCylinderCharges(
-            xc, zc, r, qSecondary
+        qPosSum, qNegSum, qPosAvgLoc, qNegAvgLoc, dipoleMoment = (
+            get_Cylinder_Charges(
+                xc, zc, r, src, primary_field, total_field, session=session
+            )
         )
         ax[1].plot(
             qPosAvgLoc[0],
@@ -755,6 +1929,13 @@ def PLOT(
             xytext=xytext_qNeg,
             fontsize=labelsize,
         )
+        xytext_p = (xmin + 1.0, ymin + 1.5)
+        ax[1].annotate(
+            "p = (%2.1e, %2.1e)" % tuple(dipoleMoment),
+            xy=xytext_p,
+            xytext=xytext_p,
+            fontsize=labelsize,
+        )
 
     ax[1].set_xlabel("x (m)", fontsize=labelsize)
     ax[1].set_ylabel("z (m)", fontsize=labelsize)
@@ -807,6 +1988,7 @@ def PLOT(
     ax[1].tick_params(axis="both", which="major", labelsize=ticksize)
     # cbar_ax = fig.add_axes([0.8, 0.05, 0.08, 0.5])
     # cbar_ax.axis("off")
+    tic = time.perf_counter()
     vmin, vmax = dat[0].get_clim()
     if Scale == "Log":
 
@@ -876,16 +2058,107 @@ def PLOT(
 
     cb.ax.tick_params(labelsize=ticksize)
     cb.set_label(label, fontsize=labelsize)
+    record_stage("colorbar", tic)
     ax[1].set_xlim([xmin, xmax])
     ax[1].set_ylim([ymin, ymax])
     ax[1].set_aspect("equal")
 
-    plt.show()
+    return fig
+
+
+@timed("PLOT")
+def PLOT(
+    survey,
+    A,
+    B,
+    M,
+    N,
+    zcLayer,
+    dzLayer,
+    xc,
+    zc,
+    r,
+    rhohalf,
+    rholayer,
+    rhoTarget,
+    Field,
+    Type,
+    Scale,
+    session=None,
+    bodies=(),
+    surrogate=None,
+    tolerance=0.02,
+):
+
+    makePlot(
+        survey,
+        A,
+        B,
+        M,
+        N,
+        zcLayer,
+        dzLayer,
+        xc,
+        zc,
+        r,
+        rhohalf,
+        rholayer,
+        rhoTarget,
+        Field,
+        Type,
+        Scale,
+        session,
+        bodies,
+        surrogate,
+        tolerance,
+    )
+    with stage("show"):
+        plt.show()
+
+
+def timingReadout(session, n=5):
+    """HTML widget with the stage timings of the last `n` updates of
+    `session`."""
+
+    readout = HTML()
+
+    def refresh(update=None):
+        updates = list(session.timings)[-n:]
+        stages = sorted(set(name for u in updates for name in u["stages"]))
+        counters = sorted(set(name for u in updates for name in u["counters"]))
+        header = "".join(
+            "<th>%s</th>" % name for name in ["update", "total (ms)"] + stages
+        )
+        rows = []
+        for u in reversed(updates):
+            cells = [u["label"], "%.1f" % (1e3 * u["total"])]
+            cells += ["%.1f" % (1e3 * u["stages"].get(name, 0.0)) for name in stages]
+            cells += [
+                ", ".join(
+                    "%s: %d" % (name, u["counters"][name])
+                    for name in counters
+                    if name in u["counters"]
+                )
+            ]
+            rows.append("".join("<td>%s</td>" % cell for cell in cells))
+        readout.value = "<table><tr>%s<th>counters</th></tr>%s</table>" % (
+            header,
+            "".join("<tr>%s</tr>" % row for row in rows),
+        )
+
+    session.listeners.append(refresh)
+    refresh()
+    return readout
 
 
-def ResLayerApp():
+def ResLayerApp(show_timings=False, bodies=(), surrogate=None, tolerance=0.02):
+    session = AppSession()
     app = widgetify(
         PLOT,
+        session=fixed(session),
+        bodies=fixed(tuple(bodies)),
+        surrogate=fixed(surrogate),
+        tolerance=fixed(tolerance),
         survey=ToggleButtons(
             options=["Dipole-Dipole", "Dipole-Pole", "Pole-Dipole", "Pole-Pole"],
             value="Dipole-Dipole",
@@ -953,4 +2226,6 @@ def ResLayerApp():
         Type=ToggleButtons(options=["Total", "Primary", "Secondary"], value="Total"),
         Scale=ToggleButtons(options=["Linear", "Log"], value="Linear"),
     )
+    if show_timings:
+        app.children = app.children + (timingReadout(session),)
     return app
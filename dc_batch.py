@@ -0,0 +1,571 @@
+"""Headless batch runs of the DC resistivity app.
+
+Evaluates a table of scenarios (survey, electrodes, layer, cylinder and
+resistivities) without any widgets or figures, spreading the work over a
+process pool and streaming the results to CSV or Parquet as they complete.
+
+Usage::
+
+    python dc_batch.py sweep scenarios.csv -o results.csv --workers 4
+    python dc_batch.py ensemble -n 1000 --vary rhoTarget=50:5000 --vary r=2:8
+    python dc_batch.py animate --vary xc=-30:30:61 --set Field=J --set rhoTarget=50 -o cylinder.mp4
+
+Columns missing from the scenario table take the `ResLayerApp` defaults.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+import subprocess
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.transforms import Bbox
+
+import dc_app
+
+SCENARIO_DEFAULTS = {
+    "survey": "Dipole-Dipole",
+    "A": -30.5,
+    "B": 30.5,
+    "M": -10.5,
+    "N": 10.5,
+    "zcLayer": -10.0,
+    "dzLayer": 2.0,
+    "xc": 0.0,
+    "zc": -25.0,
+    "r": 5.0,
+    "rhohalf": 500.0,
+    "rholayer": 5000.0,
+    "rhoTarget": 500.0,
+}
+
+SCENARIO_COLUMNS = list(SCENARIO_DEFAULTS)
+
+
+def normalize_scenario(row):
+    """Fill in defaults and convert a scenario row to the types `PLOT` uses."""
+    scenario = dict(SCENARIO_DEFAULTS)
+    for key, val in row.items():
+        if key not in SCENARIO_DEFAULTS or val is None or val == "":
+            continue
+        scenario[key] = str(val) if key == "survey" else float(val)
+    if scenario["survey"] not in dc_app.SURVEY_TYPES:
+        raise ValueError(
+            "survey must be one of %s, not %r"
+            % (", ".join(dc_app.SURVEY_TYPES), scenario["survey"])
+        )
+    return scenario
+
+
+def read_scenarios(path):
+    """Read a scenario table from a CSV or Parquet file."""
+    if os.path.splitext(path)[1].lower() in (".parquet", ".pq"):
+        import pyarrow.parquet as pq
+
+        return [normalize_scenario(row) for row in pq.read_table(path).to_pylist()]
+
+    with open(path, newline="") as f:
+        return [normalize_scenario(row) for row in csv.DictReader(f)]
+
+
+def _model_key(scenario):
+    # scenarios sharing this key reuse the same pole solves in dc_app,
+    # whatever their survey type
+    return (
+        scenario["A"],
+        scenario["B"],
+        scenario["zcLayer"],
+        scenario["dzLayer"],
+        scenario["xc"],
+        scenario["zc"],
+        scenario["r"],
+        scenario["rhohalf"],
+        scenario["rholayer"],
+        scenario["rhoTarget"],
+    )
+
+
+def unused_electrodes(survey):
+    """Electrodes `survey` does not use: B of a pole source, N of a pole
+    receiver."""
+    source, receiver = survey.split("-")
+    return [key for key, kind in (("B", source), ("N", receiver)) if kind == "Pole"]
+
+
+def _result_record(index, scenario, rho_a, VM, VN, xSurface, phiSurface):
+    record = {"scenario": index}
+    record.update(scenario)
+    # the defaults filled in for unused electrodes are not part of the survey
+    for key in unused_electrodes(scenario["survey"]):
+        record[key] = float("nan")
+    record["rho_a"] = float(rho_a)
+    record["VM"] = float(VM)
+    record["VN"] = float(VN)
+    for x, phi in zip(xSurface, phiSurface):
+        record["phi_%g" % x] = float(phi)
+    return record
+
+
+def _init_worker(setup):
+    # workers do not inherit the mesh under the spawn start method
+    dc_app.setup_mesh(**setup)
+
+
+def _run_group(group):
+    records = []
+    for index, scenario in group:
+        result = dc_app.simulateSurvey(**scenario)
+        records.append(
+            _result_record(
+                index,
+                scenario,
+                result["rho_a"],
+                result["VM"],
+                result["VN"],
+                result["xSurface"],
+                result["phiTotalSurface"],
+            )
+        )
+    return records
+
+
+def run_scenarios(scenarios, workers=None):
+    """Evaluate scenarios over a process pool.
+
+    Scenarios that share a model and source are sent to the same worker so
+    that only the first of them needs a solve. Workers use the mesh of the
+    last `dc_app.setup_mesh`. Yields lists of result records in completion
+    order.
+    """
+    groups = {}
+    for index, scenario in enumerate(scenarios):
+        try:
+            scenario = normalize_scenario(scenario)
+            dc_app.checkReceivers(scenario["survey"], scenario["M"], scenario["N"])
+        except ValueError as err:
+            raise ValueError("scenario %d: %s" % (index, err))
+        groups.setdefault(_model_key(scenario), []).append((index, scenario))
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(dc_app.meshSetup,)
+    ) as pool:
+        futures = [pool.submit(_run_group, group) for group in groups.values()]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# parameters an ensemble may vary; the survey and electrodes stay fixed so
+# that every realisation shares the same source and G2D correction
+ENSEMBLE_PARAMETERS = [
+    "zcLayer", "dzLayer", "xc", "zc", "r", "rhohalf", "rholayer", "rhoTarget"
+]
+
+
+def sample_scenarios(n, ranges, base=None, seed=None):
+    """Draw `n` random realisations of the model parameters.
+
+    `ranges` maps parameter names to (low, high). Geometry is drawn
+    uniformly and resistivities log-uniformly. Returns a dict of arrays,
+    with the fixed parameters taken from `base` and the app defaults.
+    """
+    for key in ranges:
+        if key not in ENSEMBLE_PARAMETERS:
+            raise ValueError(
+                "cannot vary {!r}, choose from {}".format(key, ENSEMBLE_PARAMETERS)
+            )
+
+    rng = np.random.default_rng(seed)
+    scenario = normalize_scenario(base or {})
+    samples = {}
+    for key in ENSEMBLE_PARAMETERS:
+        if key not in ranges:
+            samples[key] = np.full(n, scenario[key])
+        elif key.startswith("rho"):
+            low, high = np.log(ranges[key])
+            samples[key] = np.exp(rng.uniform(low, high, n))
+        else:
+            samples[key] = rng.uniform(ranges[key][0], ranges[key][1], n)
+    return samples
+
+
+def _solve_chunk(survey, A, B, models):
+    return dc_app.solveSurfacePotentials(survey, A, B, models)
+
+
+def run_ensemble(n, ranges, base=None, seed=None, workers=None, chunksize=8):
+    """Monte Carlo run over random layer, cylinder and resistivity values.
+
+    All model vectors are built up front as one (n, nC) array. The primary
+    is solved once, for a unit conductivity half-space, and scaled to each
+    half-space resistivity; the total field solves are spread over a
+    process pool in chunks of `chunksize` models, on the mesh of the last
+    `dc_app.setup_mesh`. Returns a dict with the samples, the apparent
+    resistivity and surface potentials of every realisation, the shared
+    primary profile and summary statistics of the apparent resistivity.
+    """
+    if dc_app.dimension != 2:
+        raise ValueError("the ensemble is solved in 2.5D, not 3D")
+
+    scenario = normalize_scenario(base or {})
+    survey, A, B, M, N = (scenario[key] for key in ["survey", "A", "B", "M", "N"])
+    dc_app.checkReceivers(survey, M, N)
+    samples = sample_scenarios(n, ranges, base=scenario, seed=seed)
+
+    models = dc_app.buildModels(
+        samples["zcLayer"],
+        samples["dzLayer"],
+        samples["xc"],
+        samples["zc"],
+        samples["r"],
+        1.0 / samples["rholayer"],
+        1.0 / samples["rhoTarget"],
+        1.0 / samples["rhohalf"],
+    )
+
+    rhohalfs = np.unique(samples["rhohalf"])
+    phiTotal = np.empty((n, 0))
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(dc_app.meshSetup,)
+    ) as pool:
+        # potentials scale exactly with rhohalf; log(1) = 0
+        primary = pool.submit(
+            _solve_chunk, survey, A, B, np.zeros((1, dc_app.mesh.nC))
+        )
+        starts = range(0, n, chunksize)
+        chunks = [
+            pool.submit(_solve_chunk, survey, A, B, models[start : start + chunksize])
+            for start in starts
+        ]
+        for start, future in zip(starts, chunks):
+            xSurface, phi = future.result()
+            if phiTotal.shape[1] == 0:
+                phiTotal = np.empty((n, len(xSurface)))
+            phiTotal[start : start + len(phi)] = phi
+        xSurface, phiUnit = primary.result()
+    phiPrim = rhohalfs[:, None] * phiUnit
+
+    MInd = np.where(xSurface == M)[0]
+    VM = phiTotal[:, MInd[0]]
+    if survey == "Dipole-Pole" or survey == "Pole-Pole":
+        VN = np.zeros(n)
+    else:
+        VN = phiTotal[:, np.where(xSurface == N)[0][0]]
+
+    rho_a = dc_app.get_G2D(survey, A, B, M, N) * dc_app.calculateRhoA(
+        survey, VM, VN, A, B, M, N
+    )
+
+    percentiles = [5, 25, 50, 75, 95]
+    summary = {
+        "n": n,
+        "mean": float(np.mean(rho_a)),
+        "std": float(np.std(rho_a)),
+        "min": float(np.min(rho_a)),
+        "max": float(np.max(rho_a)),
+    }
+    for q, val in zip(percentiles, np.percentile(rho_a, percentiles)):
+        summary["p%02d" % q] = float(val)
+
+    return {
+        "scenario": scenario,
+        "samples": samples,
+        "rho_a": rho_a,
+        "VM": VM,
+        "VN": VN,
+        "xSurface": xSurface,
+        "phiTotalSurface": phiTotal,
+        "rhohalf": rhohalfs,
+        "phiPrimSurface": phiPrim,
+        "summary": summary,
+    }
+
+
+PLOT_DEFAULTS = {"Field": "Model", "Type": "Total", "Scale": "Linear"}
+
+
+def parameter_path(base=None, **paths):
+    """Frames for an animation: `base` values with some parameters moving.
+
+    Each keyword gives the sequence of values one parameter takes; all
+    sequences must have the same length, one value per frame.
+    """
+    frame = dict(normalize_scenario(base or {}), **PLOT_DEFAULTS)
+    frame.update(
+        (key, val) for key, val in (base or {}).items() if key in PLOT_DEFAULTS
+    )
+
+    lengths = set(len(val) for val in paths.values())
+    if len(lengths) != 1:
+        raise ValueError("every parameter path needs the same number of frames")
+
+    frames = []
+    for ii in range(lengths.pop()):
+        frames.append(dict(frame, **{key: val[ii] for key, val in paths.items()}))
+    return frames
+
+
+def _init_renderer(setup):
+    plt.switch_backend("Agg")
+    _init_worker(setup)
+
+
+# the part of the 6 x 9 inch app figure that holds the axes, labels and the
+# rho_a box, in inches; fixed so that every frame has the same size
+FRAME_BBOX = Bbox([[-0.1, 0.9], [7.0, 8.2]])
+
+
+def _render_chunk(frames, dpi):
+    images = []
+    for frame in frames:
+        fig = dc_app.makePlot(**frame)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=dpi, bbox_inches=FRAME_BBOX)
+        plt.close(fig)
+        images.append(buf.getvalue())
+    return images
+
+
+def render_frames(frames, workers=None, chunksize=4, dpi=100):
+    """Render `makePlot` figures for each frame with Agg over a process pool.
+
+    Consecutive frames go to the same worker in chunks of `chunksize`, so
+    frames that share a model and source reuse the worker's field cache.
+    Frames use the mesh of the last `dc_app.setup_mesh`. Yields the PNG
+    bytes of each frame, in order.
+    """
+    chunks = [frames[ii : ii + chunksize] for ii in range(0, len(frames), chunksize)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_renderer,
+        initargs=(dc_app.meshSetup,),
+    ) as pool:
+        for images in pool.map(_render_chunk, chunks, [dpi] * len(chunks)):
+            for image in images:
+                yield image
+
+
+def animate(frames, output, fps=10, workers=None, chunksize=4, dpi=100):
+    """Write rendered frames as an MP4 or as a numbered PNG sequence.
+
+    An `output` ending in .mp4 is encoded with a local ffmpeg, fed the
+    frames as they are rendered. Otherwise, or when ffmpeg is not available,
+    `output` is a directory that receives frame_0000.png, frame_0001.png, ...
+    Returns the path written.
+    """
+    images = render_frames(frames, workers=workers, chunksize=chunksize, dpi=dpi)
+
+    if output.lower().endswith(".mp4"):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is not None:
+            encoder = subprocess.Popen(
+                [
+                    ffmpeg, "-y", "-loglevel", "error",
+                    "-f", "image2pipe", "-framerate", str(fps), "-i", "-",
+                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                    output,
+                ],
+                stdin=subprocess.PIPE,
+            )
+            try:
+                for image in images:
+                    encoder.stdin.write(image)
+            finally:
+                encoder.stdin.close()
+                if encoder.wait() != 0:
+                    raise RuntimeError("ffmpeg failed to encode %s" % output)
+            return output
+
+        warnings.warn("ffmpeg not found, writing a PNG sequence instead")
+        output = os.path.splitext(output)[0]
+
+    os.makedirs(output, exist_ok=True)
+    for ii, image in enumerate(images):
+        with open(os.path.join(output, "frame_%04d.png" % ii), "wb") as f:
+            f.write(image)
+    return output
+
+
+class CSVResultWriter(object):
+    def __init__(self, path):
+        self._file = open(path, "w", newline="")
+        self._writer = None
+
+    def write(self, records):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, fieldnames=list(records[0]))
+            self._writer.writeheader()
+        self._writer.writerows(records)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter(object):
+    def __init__(self, path):
+        import pyarrow  # noqa: F401
+
+        self._path = path
+        self._writer = None
+
+    def write(self, records):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(records)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._path, table.schema)
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def open_writer(path):
+    if os.path.splitext(path)[1].lower() in (".parquet", ".pq"):
+        return ParquetResultWriter(path)
+    return CSVResultWriter(path)
+
+
+def sweep(scenario_path, output_path, workers=None):
+    scenarios = read_scenarios(scenario_path)
+    writer = open_writer(output_path)
+    try:
+        for records in run_scenarios(scenarios, workers=workers):
+            writer.write(records)
+    finally:
+        writer.close()
+    return len(scenarios)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sweep_parser = subparsers.add_parser(
+        "sweep", help="evaluate a table of scenarios"
+    )
+    sweep_parser.add_argument("scenarios", help="scenario table (.csv or .parquet)")
+    sweep_parser.add_argument(
+        "-o", "--output", required=True, help="results file (.csv or .parquet)"
+    )
+    sweep_parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of processes"
+    )
+
+    ensemble_parser = subparsers.add_parser(
+        "ensemble", help="Monte Carlo run over random model parameters"
+    )
+    ensemble_parser.add_argument(
+        "-n", "--realisations", type=int, default=1000, help="number of draws"
+    )
+    ensemble_parser.add_argument(
+        "--vary",
+        action="append",
+        default=[],
+        metavar="NAME=LOW:HIGH",
+        help="parameter to draw at random, e.g. rhoTarget=50:5000",
+    )
+    ensemble_parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="fixed scenario value, e.g. survey=Pole-Dipole",
+    )
+    ensemble_parser.add_argument("--seed", type=int, default=None)
+    ensemble_parser.add_argument(
+        "-o", "--output", default=None, help="per-realisation results file"
+    )
+    ensemble_parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of processes"
+    )
+
+    animate_parser = subparsers.add_parser(
+        "animate", help="render frames along a parameter path"
+    )
+    animate_parser.add_argument(
+        "--vary",
+        action="append",
+        required=True,
+        metavar="NAME=START:STOP:FRAMES",
+        help="parameter to move linearly, e.g. xc=-30:30:61",
+    )
+    animate_parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="fixed value, e.g. Field=J or survey=Pole-Dipole",
+    )
+    animate_parser.add_argument(
+        "-o", "--output", required=True, help="MP4 file or PNG directory"
+    )
+    animate_parser.add_argument("--fps", type=int, default=10)
+    animate_parser.add_argument("--dpi", type=int, default=100)
+    animate_parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of processes"
+    )
+
+    args = parser.parse_args(argv)
+    if args.command == "sweep":
+        n = sweep(args.scenarios, args.output, workers=args.workers)
+        print("wrote %d scenarios to %s" % (n, args.output))
+    elif args.command == "ensemble":
+        ranges = {}
+        for item in args.vary:
+            key, bounds = item.split("=")
+            ranges[key] = tuple(float(v) for v in bounds.split(":"))
+        base = dict(item.split("=") for item in args.set)
+        result = run_ensemble(
+            args.realisations, ranges, base=base, seed=args.seed, workers=args.workers
+        )
+        if args.output is not None:
+            writer = open_writer(args.output)
+            try:
+                writer.write(
+                    [
+                        _result_record(
+                            ii,
+                            dict(
+                                result["scenario"],
+                                **{
+                                    key: float(val[ii])
+                                    for key, val in result["samples"].items()
+                                },
+                            ),
+                            result["rho_a"][ii],
+                            result["VM"][ii],
+                            result["VN"][ii],
+                            result["xSurface"],
+                            result["phiTotalSurface"][ii],
+                        )
+                        for ii in range(args.realisations)
+                    ]
+                )
+            finally:
+                writer.close()
+        print(json.dumps(result["summary"], indent=2))
+    elif args.command == "animate":
+        paths = {}
+        for item in args.vary:
+            key, bounds = item.split("=")
+            start, stop, num = bounds.split(":")
+            paths[key] = np.linspace(float(start), float(stop), int(num))
+        frames = parameter_path(dict(item.split("=") for item in args.set), **paths)
+        output = animate(
+            frames, args.output, fps=args.fps, workers=args.workers, dpi=args.dpi
+        )
+        print("wrote %d frames to %s" % (len(frames), output))
+
+
+if __name__ == "__main__":
+    main()
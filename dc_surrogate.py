@@ -0,0 +1,477 @@
+"""Reduced-basis surrogate of the DC resistivity app for instant previews.
+
+Pole sources at fixed electrodes are solved offline, with full 2.5D solves,
+for layer + cylinder models sampled across the `ResLayerApp` slider ranges.
+Their potentials at every wavenumber are compressed onto a POD basis. A
+preview solves the 2.5D system projected onto that basis (a Galerkin
+reduced-basis solve), so it uses the model itself rather than interpolating
+between snapshots. The system is linear in the face and cell conductivities,
+so the projected matrices of the half-space are kept and only the faces and
+cells of the layer, cylinder and other bodies are added to them; a preview
+takes a few milliseconds.
+
+The error estimate is the difference between the preview and the one from
+the leading two thirds of the basis.
+
+Usage::
+
+    python dc_surrogate.py -n 200 -o surrogate.npz --workers 4
+
+and in the notebook::
+
+    import dc_surrogate
+    ResLayerApp(surrogate=dc_surrogate.load("surrogate.npz"))
+
+The app then draws every view from the surrogate, and uses the full solver
+when the error estimate exceeds the tolerance.
+"""
+
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.constants import epsilon_0
+from scipy.stats import qmc
+
+import dc_app
+
+# ResLayerApp slider ranges; resistivities are relative to rhohalf, as
+# potentials scale exactly with rhohalf
+PARAMETER_RANGES = {
+    "zcLayer": (-10.0, 0.0),
+    "dzLayer": (1.0, 5.0),
+    "xc": (-30.0, 30.0),
+    "zc": (-30.0, -15.0),
+    "r": (1.0, 10.0),
+    "rholayer": (1e-2, 1e2),
+    "rhoTarget": (1e-2, 1e2),
+}
+PARAMETERS = list(PARAMETER_RANGES)
+LOG_PARAMETERS = ["rholayer", "rhoTarget"]
+
+
+def sample_parameters(n, ranges=None, seed=None):
+    """`n` Latin hypercube samples of the slider parameters.
+
+    Returns a dict of arrays; resistivity ratios are sampled log-uniformly.
+    """
+
+    ranges = dict(PARAMETER_RANGES, **(ranges or {}))
+    unit = qmc.LatinHypercube(d=len(PARAMETERS), seed=seed).random(n)
+    params = {}
+    for ii, name in enumerate(PARAMETERS):
+        low, high = ranges[name]
+        if name in LOG_PARAMETERS:
+            params[name] = 10.0 ** (
+                np.log10(low) + unit[:, ii] * (np.log10(high) - np.log10(low))
+            )
+        else:
+            params[name] = low + unit[:, ii] * (high - low)
+    return params
+
+
+def _simulation(electrodes):
+    srcs = [dc_app.dc.sources.Pole([], np.r_[x, 0.0]) for x in electrodes]
+    return dc_app.dc.Simulation2DCellCentered(
+        dc_app.mesh,
+        survey=dc_app.dc.Survey(srcs),
+        sigmaMap=dc_app.mapping,
+        solver=dc_app.Solver,
+    )
+
+
+def _solve_chunk(electrodes, models):
+    # potentials of every pole at every wavenumber for each model, scaled to
+    # unit norm, one snapshot per column
+    sim = _simulation(electrodes)
+    snapshots = np.hstack(
+        [
+            dc_app.solve_fields(sim, m)[:, "phiSolution", :].reshape(sim.mesh.nC, -1)
+            for m in models
+        ]
+    )
+    return snapshots / np.linalg.norm(snapshots, axis=0)
+
+
+def _compress(basis, snapshots, rank):
+    # leading `rank` left singular vectors and values of [basis, snapshots]
+    U, s, _ = np.linalg.svd(np.hstack([basis, snapshots]), full_matrices=False)
+    return U[:, :rank], s[:rank]
+
+
+def train(
+    n=200,
+    electrodes=(-30.5, 30.5),
+    ranges=None,
+    seed=0,
+    workers=None,
+    chunksize=8,
+    rank=100,
+):
+    """Solve `n` models on the current 2D mesh and fit a `ReducedBasis`.
+
+    `electrodes` are the current electrode locations the surrogate serves,
+    for any survey type. Snapshots are solved over a process pool of
+    `workers` (1 solves them here) and folded into the POD as they arrive,
+    keeping twice the vectors needed until the last chunk.
+    """
+
+    if dc_app.dimension != 2:
+        raise ValueError("the surrogate is trained on 2.5D solves, not 3D")
+
+    electrodes = [float(x) for x in electrodes]
+    params = sample_parameters(n, ranges, seed)
+    # unit half-space conductivity, so log(sigHalf) = 0
+    models = dc_app.buildModels(
+        params["zcLayer"],
+        params["dzLayer"],
+        params["xc"],
+        params["zc"],
+        params["r"],
+        1.0 / params["rholayer"],
+        1.0 / params["rhoTarget"],
+        1.0,
+    )
+    chunks = [models[ii : ii + chunksize] for ii in range(0, n, chunksize)]
+
+    # the half-space solutions lead the basis as they are, so that primary
+    # fields are exact; the rest is the POD of what they do not capture
+    halfspace = _solve_chunk(electrodes, [np.zeros(dc_app.mesh.nC)])
+    halfspace = np.linalg.qr(halfspace)[0]
+    nPOD = rank - halfspace.shape[1]
+    if nPOD < 1:
+        raise ValueError(
+            "rank must exceed %d, the number of half-space solutions"
+            % halfspace.shape[1]
+        )
+
+    def fold(basis, snapshots):
+        snapshots = snapshots - halfspace @ (halfspace.T @ snapshots)
+        U, s = _compress(basis, snapshots, 2 * nPOD)
+        return U * s
+
+    basis = np.empty((dc_app.mesh.nC, 0))
+    if workers == 1:
+        for chunk in chunks:
+            basis = fold(basis, _solve_chunk(electrodes, chunk))
+    else:
+        ncx = dc_app.mesh.shape_cells[0] - 2 * dc_app.npad
+        ncz = dc_app.mesh.shape_cells[1] - dc_app.npad
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=dc_app.setup_mesh, initargs=(ncx, ncz)
+        ) as pool:
+            for snapshots in pool.map(
+                _solve_chunk, itertools.repeat(electrodes), chunks
+            ):
+                basis = fold(basis, snapshots)
+
+    U, s = _compress(basis, np.empty((dc_app.mesh.nC, 0)), nPOD)
+    return ReducedBasis(np.hstack([halfspace, U]), electrodes, dc_app._mesh_key(), s)
+
+
+class ReducedFields(object):
+    """Fields of the poles of a `ReducedBasis`, from reduced coefficients.
+
+    Indexed like simpeg fields, `f[j, name]`, with the index `j` of the pole
+    in `surrogate.electrodes` and "phi", "e", "j" or "charge"; computed as in
+    simpeg's `Fields2DCellCentered`. `mf` is the diagonal of `MfRhoI`, and
+    `coarse` the coefficients from fewer basis vectors, if any.
+    """
+
+    def __init__(self, surrogate, coefficients, mf, coarse=None):
+        self.surrogate = surrogate
+        self.coefficients = coefficients
+        self.mf = mf
+        self.coarse = coarse
+        self._values = {}
+
+    def __getitem__(self, key):
+        pole, name = key
+        if (pole, name) in self._values:
+            return self._values[(pole, name)]
+
+        rb = self.surrogate
+        c = self.coefficients[:, :, pole]
+        if name == "phi":
+            value = rb.basis @ (rb.weights @ c)
+        elif name in ("e", "j", "charge"):
+            # (G - MBC) phi, integrated over wavenumber
+            gradPhi = rb.GV @ (rb.weights @ c)
+            gradPhi[rb.boundaryFaces] -= np.einsum(
+                "k,kfr,kr->f", rb.weights, rb.BV, c
+            )
+            if name == "j":
+                value = self.mf * gradPhi
+            else:
+                value = rb.mf0 * gradPhi
+                if name == "charge":
+                    value = epsilon_0 * rb.mesh.cell_volumes * (
+                        rb.mesh.face_divergence @ value
+                    )
+        else:
+            raise KeyError("unknown field %r" % name)
+
+        self._values[(pole, name)] = value[:, None]
+        return self._values[(pole, name)]
+
+
+class ReducedBasis(object):
+    """Galerkin reduced-basis model of pole potentials on the app mesh.
+
+    `basis` has orthonormal columns spanning the pole potentials at every
+    wavenumber of the 2.5D quadrature, for poles at `electrodes`. It is only
+    valid on the mesh it was trained on, given by `mesh_key`.
+    """
+
+    def __init__(self, basis, electrodes, mesh_key, singular_values=None):
+        # `singular_values` of the POD part of the basis, for reference
+        if mesh_key != dc_app._mesh_key():
+            raise ValueError(
+                "the surrogate was trained on another mesh; set that mesh "
+                "with dc_app.setup_mesh first"
+            )
+        self.basis = np.asarray(basis, dtype=float)
+        self.electrodes = [float(x) for x in electrodes]
+        self.mesh_key = mesh_key
+        self.singular_values = singular_values
+        self.rank = self.basis.shape[1]
+        self.mesh = dc_app.mesh
+
+        # A(ky) = G^T MfRhoI (G - MBC(ky)) + ky^2 MccSigma for the 2D cell
+        # centred simulation, and MfRhoI is 1 / (2 aveF2CC^T (vol * rho))
+        sim = _simulation(self.electrodes)
+        sim.model = np.zeros(self.mesh.nC)
+        self.kys, self.weights = sim._quad_points, sim._quad_weights
+        for ky in self.kys:
+            sim.setBC(ky)
+        MBC = [sim._MBC[ky].tocsr() for ky in self.kys]
+
+        self.faceAverage = (
+            self.mesh.aveF2CC.T @ sp.diags(self.mesh.cell_volumes)
+        ).tocsr()
+        self.mf0 = 0.5 / (self.faceAverage @ np.ones(self.mesh.nC))
+        self.boundaryFaces = np.unique(np.concatenate([B.nonzero()[0] for B in MBC]))
+
+        V = self.basis
+        self.GV = sim.Grad @ V
+        self.BV = np.array([(B @ V)[self.boundaryFaces] for B in MBC])
+        GVb = self.GV[self.boundaryFaces]
+        self.K0 = self.GV.T @ (self.mf0[:, None] * self.GV)
+        self.M0 = V.T @ (self.mesh.cell_volumes[:, None] * V)
+        self.C0 = np.array(
+            [GVb.T @ (self.mf0[self.boundaryFaces, None] * BV) for BV in self.BV]
+        )
+        self.Qr = V.T @ sim.getRHS(self.kys[0])
+
+        self._halfspace = self.solve(np.zeros(self.mesh.nC))
+
+    def _reduced_matrix(self, m):
+        # projected A(ky) for each wavenumber, for `m` relative to the
+        # half-space: the half-space part plus the faces and cells it changes
+        sigma = np.exp(m)
+        dmf = 0.5 / (self.faceAverage @ (1.0 / sigma)) - self.mf0
+        faces = np.flatnonzero(dmf)
+        cells = np.flatnonzero(sigma != 1.0)
+        dsigma = self.mesh.cell_volumes[cells] * (sigma[cells] - 1.0)
+
+        GVf = self.GV[faces]
+        K = self.K0 + GVf.T @ (dmf[faces, None] * GVf)
+        M = self.M0 + self.basis[cells].T @ (dsigma[:, None] * self.basis[cells])
+        dmfb = dmf[self.boundaryFaces]
+        onBoundary = np.flatnonzero(dmfb)
+        GVb = self.GV[self.boundaryFaces[onBoundary]]
+        C = self.C0 + np.array(
+            [
+                GVb.T @ (dmfb[onBoundary, None] * BV[onBoundary])
+                for BV in self.BV
+            ]
+        )
+
+        return K - C + self.kys[:, None, None] ** 2 * M
+
+    def solve(self, m, rank=None):
+        """Reduced coefficients for the log-conductivity `m`, relative to the
+        half-space.
+
+        Returns an array indexed `[wavenumber, basis vector, pole]`, using the
+        leading `rank` basis vectors (default all).
+        """
+
+        A = self._reduced_matrix(m)
+        rank = self.rank if rank is None else rank
+        return np.linalg.solve(A[:, :rank, :rank], self.Qr[:rank])
+
+    def fields(self, m, sigHalf):
+        """`ReducedFields` of the poles for the log-conductivity `m` with
+        half-space conductivity `sigHalf`.
+
+        The coefficients from the leading two thirds of the basis are kept
+        too, for `error`.
+        """
+
+        m = m - np.log(sigHalf)
+        A = self._reduced_matrix(m)
+        coarse = 2 * self.rank // 3
+        return ReducedFields(
+            self,
+            np.linalg.solve(A, self.Qr) / sigHalf,
+            sigHalf * 0.5 / (self.faceAverage @ np.exp(-m)),
+            np.linalg.solve(A[:, :coarse, :coarse], self.Qr[:coarse]) / sigHalf,
+        )
+
+    def error(self, fields, poles):
+        """Relative difference between the potential of the pole, or of the
+        dipole `poles[0] - poles[1]`, and that from the coarse coefficients.
+        """
+
+        # the basis is orthonormal, so potential norms are coefficient norms
+        phi, coarse = [
+            sum(
+                sign * (self.weights @ c[:, :, j])
+                for sign, j in zip([1.0, -1.0], poles)
+            )
+            for c in (fields.coefficients, fields.coarse)
+        ]
+        diff = phi.copy()
+        diff[: len(coarse)] -= coarse
+        return np.linalg.norm(diff) / np.linalg.norm(phi)
+
+    def preview(
+        self,
+        A,
+        B,
+        zcLayer,
+        dzLayer,
+        xc,
+        zc,
+        r,
+        sigLayer,
+        sigTarget,
+        sigHalf,
+        tolerance,
+        bodies=(),
+    ):
+        """`model_fields` output from the surrogate, plus its error estimate.
+
+        Returns `(mtrue, mhalf, src, primary_field, total_field, error)`, or
+        None when the mesh or an electrode differs from the training, or
+        the error estimate exceeds `tolerance`.
+        """
+
+        electrodes = [A] if B == [] else [A, B]
+        if self.mesh_key != dc_app._mesh_key() or any(
+            x not in self.electrodes for x in electrodes
+        ):
+            dc_app.count("surrogate_fallbacks")
+            return None
+
+        mtrue, mhalf = dc_app.assembleModel(
+            zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf, {}, bodies
+        )
+        poles = [self.electrodes.index(x) for x in electrodes]
+        total = self.fields(mtrue, sigHalf)
+        error = self.error(total, poles)
+        if not error <= tolerance:
+            dc_app.count("surrogate_fallbacks")
+            return None
+        dc_app.count("surrogate_previews")
+
+        # the half-space solutions are in the basis, so its reduced solution
+        # is exact; it also gives the unit half-space poles get_G2D solves for
+        halfspace = ReducedFields(self, self._halfspace, self.mf0)
+        CCLoc = self.mesh.cell_centers
+        surfaceInd = np.where(CCLoc[:, 1] == np.max(CCLoc[:, 1]))[0]
+        refInd = self.mesh.closest_points_index(
+            [dc_app.xmax + 60.0, 0.0], grid_loc="CC"
+        )
+
+        def halfspace_poles(missing):
+            phis = [
+                halfspace[poles[electrodes.index(key[-1])], "phi"][:, 0]
+                for key in missing
+            ]
+            return [(phi[surfaceInd], np.squeeze(phi[refInd])) for phi in phis]
+
+        dc_app._store.get_many(
+            dc_app._halfspace_pole_keys(electrodes), halfspace_poles
+        )
+
+        primary = ReducedFields(self, self._halfspace / sigHalf, sigHalf * self.mf0)
+        return (
+            mtrue,
+            mhalf,
+            dc_app._source(A, B),
+            dc_app.SuperposedFields(dict(zip(electrodes, zip([primary] * 2, poles)))),
+            dc_app.SuperposedFields(dict(zip(electrodes, zip([total] * 2, poles)))),
+            error,
+        )
+
+
+def save(surrogate, path):
+    """Write the basis of `surrogate` to an ``.npz`` file."""
+
+    np.savez_compressed(
+        path,
+        basis=surrogate.basis,
+        electrodes=surrogate.electrodes,
+        singular_values=surrogate.singular_values,
+        mesh_shape=surrogate.mesh_key[0],
+        mesh_origin=surrogate.mesh_key[1],
+        mesh_h=surrogate.mesh_key[2],
+    )
+
+
+def load(path):
+    """Read a `ReducedBasis` written by `save`; the app mesh must match."""
+
+    with np.load(path) as data:
+        return ReducedBasis(
+            data["basis"],
+            data["electrodes"],
+            (
+                tuple(int(n) for n in data["mesh_shape"]),
+                tuple(float(x) for x in data["mesh_origin"]),
+                tuple(float(h) for h in data["mesh_h"]),
+            ),
+            data["singular_values"],
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "-n", "--snapshots", type=int, default=200, help="number of models solved"
+    )
+    parser.add_argument(
+        "--rank", type=int, default=100, help="number of basis vectors"
+    )
+    parser.add_argument(
+        "--electrodes",
+        default="-30.5,30.5",
+        help="comma-separated current electrode locations",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", required=True, help="surrogate .npz file")
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="number of processes"
+    )
+
+    args = parser.parse_args(argv)
+    surrogate = train(
+        args.snapshots,
+        electrodes=[float(x) for x in args.electrodes.split(",")],
+        seed=args.seed,
+        workers=args.workers,
+        rank=args.rank,
+    )
+    save(surrogate, args.output)
+    print(
+        "wrote a basis of %d vectors from %d models to %s"
+        % (surrogate.rank, args.snapshots, args.output)
+    )
+
+
+if __name__ == "__main__":
+    main()
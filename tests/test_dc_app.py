@@ -0,0 +1,278 @@
+import threading
+
+import numpy as np
+import pytest
+from matplotlib.path import Path
+from simpeg.electromagnetics.static import resistivity as dc
+
+import dc_app
+
+
+def scalar_rhoA(survey, VM, VN, A, B, M, N):
+    # the per-survey formulas calculateRhoA replaced
+    eps = 1e-9
+    if survey == "Dipole-Dipole":
+        G = 1.0 / (
+            1.0 / (np.abs(A - M) + eps)
+            - 1.0 / (np.abs(M - B) + eps)
+            - 1.0 / (np.abs(N - A) + eps)
+            + 1.0 / (np.abs(N - B) + eps)
+        )
+        return (VM - VN) * 2.0 * np.pi * G
+    elif survey == "Pole-Dipole":
+        G = 1.0 / (1.0 / (np.abs(A - M) + eps) - 1.0 / (np.abs(N - A) + eps))
+        return (VM - VN) * 2.0 * np.pi * G
+    elif survey == "Dipole-Pole":
+        G = 1.0 / (1.0 / (np.abs(A - M) + eps) - 1.0 / (np.abs(M - B) + eps))
+        return VM * 2.0 * np.pi * G
+    G = 1.0 / (1.0 / (np.abs(A - M) + eps))
+    return VM * 2.0 * np.pi * G
+
+
+def test_calculateRhoA_scalar_and_array():
+    rng = np.random.default_rng(0)
+    n = 200
+    survey = rng.choice(dc_app.SURVEY_TYPES, n)
+    A, B, M, N = (rng.uniform(-30, 30, n) for _ in range(4))
+    VM, VN = rng.standard_normal(n), rng.standard_normal(n)
+
+    expected = [
+        scalar_rhoA(*args) for args in zip(survey, VM, VN, A, B, M, N)
+    ]
+    np.testing.assert_allclose(
+        dc_app.calculateRhoA(survey, VM, VN, A, B, M, N), expected, rtol=1e-12
+    )
+    for ii in range(10):
+        rho_a = dc_app.calculateRhoA(
+            survey[ii], VM[ii], VN[ii], A[ii], B[ii], M[ii], N[ii]
+        )
+        assert np.ndim(rho_a) == 0
+        np.testing.assert_allclose(rho_a, expected[ii], rtol=1e-12)
+
+
+@pytest.mark.parametrize("survey", dc_app.SURVEY_TYPES)
+def test_calculateRhoA_unused_electrodes(survey):
+    B = [] if survey.startswith("Pole-") else 20.5
+    N = [] if survey.endswith("-Pole") else 10.5
+    rho_a = dc_app.calculateRhoA(survey, 0.3, 0.1, -30.5, B, -10.5, N)
+    rho_nan = dc_app.calculateRhoA(
+        survey,
+        0.3,
+        0.1,
+        -30.5,
+        np.nan if B == [] else B,
+        -10.5,
+        np.nan if N == [] else N,
+    )
+    assert np.isfinite(rho_a)
+    assert rho_a == rho_nan
+    np.testing.assert_allclose(
+        rho_a,
+        scalar_rhoA(survey, 0.3, 0.1, -30.5, 20.5, -10.5, 10.5),
+        rtol=1e-12,
+    )
+
+
+@pytest.mark.parametrize("survey", dc_app.SURVEY_TYPES)
+def test_G2D_halfspace(survey):
+    # G2D times the 2.5D apparent resistivity of a half-space is rhohalf
+    for A, B, M, N in [(-30.5, 30.5, -10.5, 10.5), (-20.5, 5.5, 0.5, 15.5)]:
+        result = dc_app.simulateSurvey(
+            survey, A, B, M, N, -10.0, 2.0, 0.0, -25.0, 5.0, 300.0, 300.0, 300.0
+        )
+        np.testing.assert_allclose(result["rho_a"], 300.0, rtol=1e-8)
+
+
+def test_timings_per_session():
+    sessions = [dc_app.AppSession(), dc_app.AppSession()]
+    readouts = [dc_app.timingReadout(s) for s in sessions]
+    seen = []
+    sessions[0].listeners.append(seen.append)
+
+    dc_app.simulateSurvey(
+        "Dipole-Dipole", -30.5, 30.5, -10.5, 10.5,
+        -10.0, 2.0, 0.0, -25.0, 5.0, 500.0, 5000.0, 50.0,
+        session=sessions[0],
+    )
+    assert len(sessions[0].timings) == 1 and len(seen) == 1
+    assert len(sessions[1].timings) == 0
+    assert "simulateSurvey" in readouts[0].value
+    assert "simulateSurvey" not in readouts[1].value
+
+
+def test_session_fields_follow_the_mesh():
+    args = (-30.5, 30.5, -10.0, 2.0, 0.0, -25.0, 5.0, 1 / 5000.0, 1 / 50.0, 1 / 500.0)
+    session = dc_app.AppSession()
+    try:
+        mtrue = dc_app.model_fields(*args, session=session)[0]
+        assert len(mtrue) == dc_app.mesh.nC
+        dc_app.setup_mesh(120, 60)
+        mtrue, mhalf, src, primary, total = dc_app.model_fields(*args, session=session)
+        assert len(mtrue) == dc_app.mesh.nC
+        assert len(total[src, "phi"]) == dc_app.mesh.nC
+    finally:
+        dc_app.setup_mesh()
+
+
+def test_sessions_share_solves():
+    args = (
+        "Dipole-Dipole", -30.5, 30.5, -10.5, 10.5,
+        -10.0, 2.0, 0.0, -25.0, 5.0, 500.0, 5000.0, 50.0,
+    )
+
+    def factorizations(nThreads):
+        dc_app.clear_caches()
+        before = dc_app.get_counters().get("factorizations", 0)
+        threads = [
+            threading.Thread(
+                target=dc_app.simulateSurvey,
+                args=args,
+                kwargs={"session": dc_app.AppSession()},
+            )
+            for _ in range(nThreads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return dc_app.get_counters()["factorizations"] - before
+
+    # concurrent sessions wait for the model and G2D pole solves of the first
+    assert factorizations(4) == factorizations(1)
+
+
+def outline_owner(bodies):
+    # the point-in-path test rasterizeBodies replaced
+    owner = np.full(dc_app.mesh.nC, -1)
+    for ii, body in enumerate(bodies):
+        outline = Path(dc_app.getBodyOutlines(body)[0])
+        owner[outline.contains_points(dc_app.mesh.cell_centers)] = ii
+    return owner
+
+
+@pytest.mark.parametrize(
+    "bodies",
+    [
+        [{"type": "cylinder", "xc": 0.3, "zc": -20.2, "r": 5.1}],
+        [{"type": "cylinder", "xc": -17.7, "zc": -8.4, "r": 2.3}],
+        [{"type": "plate", "xc": 1.2, "zc": -15.3, "dx": 20.0, "dz": 3.1, "rotAng": 30.0}],
+        [{"type": "plate", "xc": -5.3, "zc": -22.1, "dx": 8.2, "dz": 14.0, "rotAng": -55.0}],
+        [
+            {"type": "plate", "xc": 0.2, "zc": -15.1, "dx": 30.0, "dz": 4.2, "rotAng": 20.0},
+            {"type": "cylinder", "xc": 5.3, "zc": -14.2, "r": 6.1},
+            {"type": "plate", "xc": 8.1, "zc": -12.3, "dx": 5.2, "dz": 12.0, "rotAng": -70.0},
+        ],
+    ],
+)
+def test_rasterizeBodies_matches_outlines(bodies):
+    owner = dc_app.rasterizeBodies(bodies)
+    np.testing.assert_array_equal(owner, outline_owner(bodies))
+    assert set(np.unique(owner)) == set(range(-1, len(bodies)))
+    for ii, body in enumerate(bodies):
+        geometry = dc_app._body_key(body)
+        np.testing.assert_array_equal(
+            dc_app.cachedMask(*geometry), outline_owner([body]) == 0
+        )
+
+
+def test_long_strike_charges_match_2D():
+    args = (-30.5, 30.5, -10.0, 2.0, 0.0, -25.0, 5.0, 1 / 5000.0, 1 / 50.0, 1 / 500.0)
+
+    def charges():
+        mtrue, mhalf, src, primary, total = dc_app.model_fields(
+            *args, session=dc_app.AppSession()
+        )
+        return dc_app.get_Cylinder_Charges(0.0, -25.0, 5.0, src, primary, total)[:2]
+
+    qPos, qNeg = charges()
+    try:
+        # the coarsened 3D mesh underestimates the charge by ~20%; the
+        # difference shrinks to ~1% with memory_budget=1200
+        dc_app.setup_mesh(dim=3, strike=1000.0, memory_budget=256)
+        np.testing.assert_allclose(charges(), [qPos, qNeg], rtol=0.3)
+    finally:
+        dc_app.setup_mesh()
+
+
+def test_superposed_fields_match_dipole_solve():
+    args = (-30.5, 30.5, -10.0, 2.0, 0.0, -25.0, 5.0, 1 / 5000.0, 1 / 50.0, 1 / 500.0)
+    mtrue, mhalf, src, primary, total = dc_app.model_fields(
+        *args, session=dc_app.AppSession()
+    )
+    dipole = dc.sources.Dipole([], np.r_[-30.5, 0.0], np.r_[30.5, 0.0])
+    direct = dc_app.solve_sources([dipole], mtrue)
+    for name in ("phi", "e", "j", "charge"):
+        expected = direct[dipole, name]
+        np.testing.assert_allclose(
+            total[src, name], expected, rtol=1e-8, atol=1e-8 * np.abs(expected).max()
+        )
+
+
+@pytest.mark.parametrize("first", dc_app.SURVEY_TYPES)
+def test_survey_type_switch_does_not_solve(first):
+    dc_app.clear_caches()
+    session = dc_app.AppSession()
+
+    def solves(survey):
+        before = dc_app.get_counters().get("solves", 0)
+        dc_app.simulateSurvey(
+            survey, -30.5, 30.5, -10.5, 10.5,
+            -10.0, 2.0, 0.0, -25.0, 5.0, 500.0, 5000.0, 50.0,
+            session=session,
+        )
+        return dc_app.get_counters().get("solves", 0) - before
+
+    assert solves(first) > 0
+    for survey in dc_app.SURVEY_TYPES + [first]:
+        assert solves(survey) == 0
+
+
+def test_store_is_bounded_by_bytes():
+    store = dc_app.SolutionStore(maxbytes=3 * 8000)
+    for ii in range(5):
+        store.get(ii, lambda: np.zeros(1000))
+    assert list(store._values) == [2, 3, 4]
+    assert store.nbytes == 3 * 8000
+    store.get(2, lambda: None)
+    store.get(5, lambda: np.zeros(1000))
+    assert list(store._values) == [4, 2, 5]
+
+
+def test_stored_fields_drop_factorizations():
+    dc_app.clear_caches()
+    dc_app.simulateSurvey(
+        "Dipole-Dipole", -30.5, 30.5, -10.5, 10.5,
+        -10.0, 2.0, 0.0, -25.0, 5.0, 500.0, 5000.0, 50.0,
+    )
+    fields = [
+        value[0] for value in dc_app._store._values.values()
+        if isinstance(value, tuple) and hasattr(value[0], "simulation")
+    ]
+    assert fields
+    for f in fields:
+        assert all(Ainv is None for Ainv in f.simulation.Ainv)
+    assert 0 < dc_app._store.nbytes <= dc_app._store.maxbytes
+
+
+def test_assembleModel_updates_in_place():
+    plate = {"type": "plate", "xc": 10.0, "zc": -15.0, "dx": 20.0, "dz": 2.0,
+             "rotAng": 30.0, "rho": 20.0}
+    cylinder = {"type": "cylinder", "xc": -15.0, "zc": -8.0, "r": 3.0, "rho": 5000.0}
+    models = [
+        ((-10.0, 2.0, 0.0, -25.0, 5.0, 1 / 5000.0, 1 / 50.0, 1 / 500.0), [plate]),
+        # conductivities only
+        ((-10.0, 2.0, 0.0, -25.0, 5.0, 1 / 100.0, 1 / 50.0, 1 / 300.0), [dict(plate, rho=5.0)]),
+        # geometry
+        ((-12.0, 4.0, 8.0, -20.0, 6.0, 1 / 100.0, 1 / 50.0, 1 / 300.0), [dict(plate, rotAng=-45.0)]),
+        # number of bodies
+        ((-12.0, 4.0, 8.0, -20.0, 6.0, 1 / 100.0, 1 / 50.0, 1 / 300.0), [plate, cylinder]),
+        ((-12.0, 4.0, 8.0, -20.0, 6.0, 1 / 100.0, 1 / 50.0, 1 / 300.0), []),
+    ]
+    cache = {}
+    for args, bodies in models:
+        mtrue, mhalf = dc_app.assembleModel(*args, cache, bodies)
+        expected = dc_app.assembleModel(*args, {}, bodies)
+        np.testing.assert_array_equal(mtrue, expected[0])
+        np.testing.assert_array_equal(mhalf, expected[1])
+        if not bodies:
+            np.testing.assert_array_equal(mtrue, dc_app.buildModels(*args)[0])
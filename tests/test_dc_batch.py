@@ -0,0 +1,146 @@
+import csv
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import dc_app
+import dc_batch
+
+
+def test_normalize_scenario():
+    scenario = dc_batch.normalize_scenario(
+        {"survey": "Pole-Dipole", "A": "-20.5", "r": "", "rhoTarget": 50, "Field": "J"}
+    )
+    assert scenario == dict(
+        dc_batch.SCENARIO_DEFAULTS, survey="Pole-Dipole", A=-20.5, rhoTarget=50.0
+    )
+    assert all(isinstance(scenario[key], float) for key in scenario if key != "survey")
+    with pytest.raises(ValueError, match="survey"):
+        dc_batch.normalize_scenario({"survey": "Wenner"})
+
+
+@pytest.mark.parametrize("survey", dc_app.SURVEY_TYPES)
+def test_result_record(survey):
+    scenario = dict(dc_batch.SCENARIO_DEFAULTS, survey=survey)
+    record = dc_batch._result_record(
+        3, scenario, 480.0, 0.2, 0.1, [-1.5, 0.5], [0.3, 0.4]
+    )
+    assert record["scenario"] == 3
+    assert record["rho_a"] == 480.0 and record["VM"] == 0.2 and record["VN"] == 0.1
+    assert record["phi_-1.5"] == 0.3 and record["phi_0.5"] == 0.4
+    assert record["A"] == scenario["A"] and record["M"] == scenario["M"]
+    # electrodes the survey does not use are not reported as placed
+    assert np.isnan(record["B"]) == survey.startswith("Pole-")
+    assert np.isnan(record["N"]) == survey.endswith("-Pole")
+
+
+def write_scenarios(path, rows):
+    with open(path, "w", newline="") as f:
+        # blank cells take the defaults
+        fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_results(path):
+    with open(path, newline="") as f:
+        return sorted(csv.DictReader(f), key=lambda row: int(row["scenario"]))
+
+
+def test_sweep_csv_round_trip(tmp_path):
+    rows = [
+        {"survey": "Dipole-Dipole", "rhoTarget": 50.0},
+        {"survey": "Pole-Pole", "A": -20.5, "xc": 5.0},
+    ]
+    write_scenarios(tmp_path / "scenarios.csv", rows)
+    n = dc_batch.sweep(
+        str(tmp_path / "scenarios.csv"), str(tmp_path / "results.csv"), workers=1
+    )
+    assert n == 2
+
+    results = read_results(tmp_path / "results.csv")
+    assert [row["survey"] for row in results] == ["Dipole-Dipole", "Pole-Pole"]
+    for row, result in zip(rows, results):
+        scenario = dc_batch.normalize_scenario(row)
+        expected = dc_app.simulateSurvey(**scenario)
+        np.testing.assert_allclose(float(result["rho_a"]), expected["rho_a"], rtol=1e-10)
+        np.testing.assert_allclose(float(result["VM"]), expected["VM"], rtol=1e-10)
+    assert results[0]["B"] == "30.5" and results[0]["N"] == "10.5"
+    assert results[1]["B"] == "nan" and results[1]["N"] == "nan"
+
+
+def test_sweep_names_the_bad_row():
+    scenarios = [{}, {"M": -10.0}]
+    with pytest.raises(ValueError, match="scenario 1: M = -10 .* nearest is -10.5"):
+        next(dc_batch.run_scenarios(scenarios, workers=1))
+
+
+def test_sweep_workers_use_the_mesh():
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    try:
+        dc_app.setup_mesh(120, 60)
+        (records,) = dc_batch.run_scenarios([{}], workers=1)
+        expected = dc_app.simulateSurvey(**dc_batch.normalize_scenario({}))
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+        dc_app.setup_mesh()
+    phis = [key for key in records[0] if key.startswith("phi_")]
+    assert len(phis) == len(expected["xSurface"])
+    np.testing.assert_allclose(records[0]["rho_a"], expected["rho_a"], rtol=1e-10)
+
+
+def test_ensemble_matches_simulateSurvey():
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    try:
+        dc_app.setup_mesh(120, 60)
+        result = dc_batch.run_ensemble(
+            2,
+            {"rhoTarget": (50.0, 5000.0), "xc": (-10.0, 10.0)},
+            base={"survey": "Pole-Dipole"},
+            seed=1,
+            workers=1,
+            chunksize=1,
+        )
+        for ii in range(2):
+            scenario = dict(
+                result["scenario"],
+                **{key: val[ii] for key, val in result["samples"].items()},
+            )
+            np.testing.assert_allclose(
+                result["rho_a"][ii],
+                dc_app.simulateSurvey(**scenario)["rho_a"],
+                rtol=1e-8,
+            )
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+        dc_app.setup_mesh()
+
+
+def test_ensemble_rejects_3D():
+    try:
+        dc_app.setup_mesh(dim=3, memory_budget=32)
+        with pytest.raises(ValueError, match="3D"):
+            dc_batch.run_ensemble(2, {"rhoTarget": (50.0, 5000.0)}, workers=1)
+    finally:
+        dc_app.setup_mesh()
+
+
+def test_render_frames_use_the_mesh():
+    frames = dc_batch.parameter_path(
+        {"Field": "J", "rhoTarget": 50.0}, xc=[-10.0, 10.0]
+    )
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    try:
+        dc_app.setup_mesh(120, 60)
+        images = list(dc_batch.render_frames(frames, workers=1, dpi=20))
+        expected = dc_batch._render_chunk(frames, 20)
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+        dc_app.setup_mesh()
+    assert images == expected
+    assert images[0] != images[1]
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import dc_app
+import dc_surrogate
+
+# A, B, zcLayer, dzLayer, xc, zc, r, sigLayer, sigTarget, sigHalf
+MODEL = (-30.5, 30.5, -5.0, 3.0, 5.0, -22.0, 6.0, 1 / 2000.0, 1 / 50.0, 1 / 500.0)
+
+
+@pytest.fixture(scope="module")
+def surrogate():
+    dc_app.setup_mesh()
+    return dc_surrogate.train(16, workers=1, rank=40)
+
+
+def relative_error(value, expected):
+    return np.linalg.norm(value - expected) / np.linalg.norm(expected)
+
+
+def test_primary_is_exact(surrogate):
+    mtrue, mhalf, src, primary, total, error = surrogate.preview(*MODEL, np.inf)
+    expected = dc_app.model_fields(*MODEL, session=dc_app.AppSession())[3]
+    for name in ("phi", "e", "j", "charge"):
+        assert relative_error(primary[src, name], expected[src, name]) < 1e-10
+
+
+def test_preview_close_to_full_solve(surrogate):
+    mtrue, mhalf, src, primary, total, error = surrogate.preview(*MODEL, np.inf)
+    expected = dc_app.model_fields(*MODEL, session=dc_app.AppSession())[4]
+    phi = dc_app.get_Surface_Potentials("Dipole-Dipole", src, total)[1]
+    phiFull = dc_app.get_Surface_Potentials("Dipole-Dipole", src, expected)[1]
+    # a basis from 16 models; the app default of 200 gets within 0.5%
+    assert 0.0 < error < np.inf
+    assert relative_error(phi, phiFull) < 0.05
+
+
+def test_preview_falls_back(surrogate):
+    # an electrode it was not trained for, and an error above the tolerance
+    assert surrogate.preview(-20.5, 30.5, *MODEL[2:], np.inf) is None
+    assert surrogate.preview(*MODEL, 0.0) is None
+
+
+def test_save_load(surrogate, tmp_path):
+    dc_surrogate.save(surrogate, tmp_path / "surrogate.npz")
+    loaded = dc_surrogate.load(tmp_path / "surrogate.npz")
+    np.testing.assert_array_equal(loaded.basis, surrogate.basis)
+    np.testing.assert_array_equal(loaded.singular_values, surrogate.singular_values)
+    assert loaded.electrodes == surrogate.electrodes
+    assert loaded.mesh_key == surrogate.mesh_key
+    src = dc_app._source(MODEL[0], MODEL[1])
+    np.testing.assert_array_equal(
+        loaded.preview(*MODEL, np.inf)[4][src, "phi"],
+        surrogate.preview(*MODEL, np.inf)[4][src, "phi"],
+    )